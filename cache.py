@@ -0,0 +1,77 @@
+import json
+import os
+import hashlib
+from datetime import timezone
+from utils import write_file_atomic, read_file, Clock
+
+
+class CacheEntry:
+    def __init__(self, j):
+        self.url = j['url']
+        self.fetched_at = j['fetched_at']
+        self.etag = j.get('etag')
+        self.last_modified = j.get('last_modified')
+        self.body = j['body']
+
+    def get_validators(self):
+        # Headers for a conditional GET, answered with 304 when the response did not change
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    On-disk cache of API responses, one file per URL. Each endpoint has its own TTL: fresh entries are served
+    without a request, stale ones are revalidated, and kept around to be served if the API is unreachable.
+    """
+
+    def __init__(self, path: str, ttls: dict, clock: Clock = None):
+        self.path = path
+        self.ttls = ttls
+        self.clock = clock if clock is not None else Clock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def get_time(self):
+        return self.clock.now(timezone.utc).timestamp()
+
+    def get_age(self, entry: CacheEntry):
+        return self.get_time() - entry.fetched_at
+
+    def get_ttl(self, url):
+        for endpoint in sorted(self.ttls.keys(), key=len, reverse=True):
+            if f'/{endpoint}' in url:
+                return self.ttls[endpoint]
+        return 0
+
+    def is_fresh(self, entry: CacheEntry):
+        return self.get_age(entry) < self.get_ttl(entry.url)
+
+    def get_filename(self, url):
+        return os.path.join(self.path, hashlib.sha1(url.encode()).hexdigest() + '.json')
+
+    def get(self, url):
+        filename = self.get_filename(url)
+        if not os.path.exists(filename):
+            return None
+        try:
+            return CacheEntry(json.loads(read_file(filename)))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, url, body, etag=None, last_modified=None):
+        entry = {'url': url, 'fetched_at': self.get_time(), 'etag': etag, 'last_modified': last_modified, 'body': body}
+        write_file_atomic(self.get_filename(url), json.dumps(entry))
+        return CacheEntry(entry)
+
+    def touch(self, entry: CacheEntry):
+        return self.put(entry.url, entry.body, entry.etag, entry.last_modified)
+
+    def prune(self, max_age_seconds):
+        for f in os.listdir(self.path):
+            filename = os.path.join(self.path, f)
+            if os.path.isfile(filename) and self.get_time() - os.path.getmtime(filename) > max_age_seconds:
+                os.remove(filename)
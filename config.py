@@ -1,8 +1,25 @@
 # User settings
 FAVORITE_TEAM = 'VGK'
-TIMEZONE = 'US/Pacific'
+TIMEZONE = 'America/Los_Angeles'  # IANA name, legacy aliases like US/Pacific are not always installed
 CHECK_LIMIT_DAYS = 10
 CHECK_UPDATE_LIVE_GAME_SECONDS = 60 * 10
+API_TIMEOUTS = (10, 30)  # Connect and read timeouts in seconds for each attempt
+API_RETRIES = 3
+API_CACHE_DIR = 'cache'
+TEMPLATE_CACHE_DIR = 'cache/templates'  # Pre-rendered logos and records of each screen
+TEMPLATE_CACHE_MAX_AGE_SECONDS = 60 * 60 * 24 * 30  # Templates unused for this long are removed
+API_CACHE_TTL_SECONDS = {  # Responses younger than this are reused without a request
+    'api/v1/teams': 60 * 60 * 24 * 7,
+    'api/v1/schedule': 60,
+    'api/v1/game': 10,
+}
+DAEMON_MORNING_HOUR = 8  # With --daemon, local hour of the daily update when no game is coming up soon
+DISPLAY = 'epd2in9bc'  # Or 'epd2in9d' for partial refreshes of the areas that changed
+FULL_REFRESH_EVERY_UPDATES = 20  # Partial-capable displays only, clears ghosting
+CLEAR_EVERY_UPDATES = 50  # Frames are drawn over the previous one, cleared first this often against ghosting
+CLEAR_EVERY_SECONDS = 60 * 60 * 24  # And at least once a day
+DISPLAY_STATE_FILE = 'display-state.json'  # Last frame shown, kept to skip identical refreshes across runs
+DISPLAY_SIMULATED = False  # Drive a simulated DISPLAY through its real driver, without a panel (e.g. to time it)
 
 # Debug
 DEBUG_ENABLED = False
@@ -1,4 +1,4 @@
 #!/bin/bash
 # Get directory of script and attempt to update git and run python script against venv
 DIR=$(dirname "$0")
-(cd "$DIR" || exit; git pull; ./venv/bin/python main.py)
\ No newline at end of file
+(cd "$DIR" || exit; git pull; ./venv/bin/python main.py "$@")
\ No newline at end of file
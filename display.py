@@ -1,7 +1,12 @@
 import os
 import sys
+import json
+import enum
+import hashlib
 import logging
-from time import sleep
+import config
+from datetime import timezone
+from utils import write_file_atomic, read_file, Clock
 
 libraries = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'libs')
 if os.path.exists(libraries):
@@ -9,52 +14,211 @@ if os.path.exists(libraries):
 
 try:
     # noinspection PyUnresolvedReferences
-    from waveshare_epd import epd2in9bc
-except OSError:
-    pass
+    from waveshare_epd import epdconfig, epd2in9bc, epd2in9d
+except (OSError, ImportError, RuntimeError) as e:
+    print(f'e-Paper drivers unavailable: {e}')
 
 
-def get_display():
+state_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), config.DISPLAY_STATE_FILE)
+
+
+def get_display(clock: Clock = None):
     try:
-        return Epd2in9bcDisplay()
+        # The hardware libraries are looked up here, but only imported once the display starts
+        if config.DISPLAY_SIMULATED:
+            print(f'Simulating {config.DISPLAY}')
+            epdconfig.use(epdconfig.Simulated(config.DISPLAY))
+        elif not epdconfig.is_available():
+            print('No e-Paper hardware found, using FakeEpd2in9bcDisplay')
+            return FakeEpd2in9bcDisplay(clock=clock)
+        if config.DISPLAY == 'epd2in9d':
+            return Epd2in9dDisplay(clock=clock)
+        return Epd2in9bcDisplay(clock=clock)
     except NameError:
-        return FakeEpd2in9bcDisplay()
+        return FakeEpd2in9bcDisplay(clock=clock)
+
+
+class PanelState(enum.Enum):
+    SLEEPING = 0
+    AWAKE = 1
+    DRAWING = 2
 
 
 class BaseDisplay:
+    """
+    Panels go SLEEPING -> AWAKE on start, AWAKE -> DRAWING -> AWAKE while cleared or updated, and back to SLEEPING
+    on stop. Each step blocks until the driver reports the panel idle, redundant ones are skipped: starting an awake
+    panel, stopping a sleeping one or clearing a panel left blank.
+    Frames are drawn straight over the previous one, a full clear is only needed every config.CLEAR_EVERY_UPDATES
+    updates or config.CLEAR_EVERY_SECONDS, whichever comes first.
+    """
 
-    def __init__(self, width: int = 0, height: int = 0):
+    def __init__(self, width: int = 0, height: int = 0, state_file: str = state_path, clock: Clock = None):
         self.size = (width, height)
+        self.state_file = state_file
+        self.clock = clock if clock is not None else Clock()
+        self.panel_state = PanelState.SLEEPING
+        self.is_blank = False  # Cleared and not drawn on since
+        self.last_frame_hash = None
+        self.last_game_hash = None
+        self.skipped_frames = 0
+        self.clear_every_updates = config.CLEAR_EVERY_UPDATES
+        self.clear_every_seconds = config.CLEAR_EVERY_SECONDS
+        self.last_cleared_at = None  # Seconds since the epoch
+        self.updates_since_clear = 0
+        self.load_state()
+
+    def load_state(self):
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return
+        try:
+            self.set_state(json.loads(read_file(self.state_file)))
+        except (OSError, ValueError, KeyError):
+            print(f'Ignoring unreadable display state in {self.state_file}')
+
+    def set_state(self, state):
+        self.last_frame_hash = state['last_frame_hash']
+        self.last_game_hash = state.get('last_game_hash')
+        self.skipped_frames = state['skipped_frames']
+        self.last_cleared_at = state.get('last_cleared_at')
+        self.updates_since_clear = state.get('updates_since_clear', 0)
+
+    def get_state(self):
+        return {'last_frame_hash': self.last_frame_hash, 'last_game_hash': self.last_game_hash,
+                'skipped_frames': self.skipped_frames, 'last_cleared_at': self.last_cleared_at,
+                'updates_since_clear': self.updates_since_clear}
+
+    def save_state(self):
+        if self.state_file is None:
+            return
+        write_file_atomic(self.state_file, json.dumps(self.get_state()))
+
+    @staticmethod
+    def get_frame_hash(b, ry):
+        h = hashlib.sha1()
+        for im in [b, ry]:
+            h.update(f'{im.mode}{im.size}'.encode())
+            h.update(im.tobytes())
+        return h.hexdigest()
+
+    def is_frame_unchanged(self, b, ry):
+        return self.last_frame_hash is not None and self.last_frame_hash == BaseDisplay.get_frame_hash(b, ry)
+
+    def is_game_unchanged(self, game_hash):
+        # Checked before drawing anything: the same game data on the same day draws the same frame
+        return self.last_frame_hash is not None and self.last_game_hash == game_hash
+
+    def set_last_game(self, game_hash):
+        self.last_game_hash = game_hash
+        self.save_state()
+
+    def skip_frame(self):
+        self.skipped_frames += 1
+        self.save_state()
+
+    def set_last_frame(self, b, ry):
+        self.last_frame_hash = BaseDisplay.get_frame_hash(b, ry)
+        self.save_state()
+
+    def get_time(self):
+        return self.clock.now(timezone.utc).timestamp()
+
+    def needs_clear(self):
+        if self.last_cleared_at is None:
+            return True
+        return self.updates_since_clear >= self.clear_every_updates \
+            or self.get_time() - self.last_cleared_at >= self.clear_every_seconds
+
+    def forget_last_frame(self):
+        self.last_frame_hash = None
+        self.last_game_hash = None
+        self.save_state()
+
+    @staticmethod
+    def get_dirty_boxes(old, new):
+        """
+        Boxes (left, top, right, bottom) around the areas that differ between two frames.
+        Changes separated by untouched columns (e.g. a score and the period clock) get their own box.
+        """
+        from PIL import Image, ImageChops
+
+        diff = ImageChops.difference(old.convert('L'), new.convert('L'))
+        bbox = diff.getbbox()
+        if bbox is None:
+            return []
+
+        columns = diff.crop((bbox[0], 0, bbox[2], diff.height)).resize((bbox[2] - bbox[0], 1), Image.BOX)
+        boxes = []
+        start = None
+        for x, value in enumerate(list(columns.getdata()) + [0]):
+            if value > 0 and start is None:
+                start = x
+            elif value == 0 and start is not None:
+                left, right = bbox[0] + start, bbox[0] + x
+                _, top, _, bottom = diff.crop((left, 0, right, diff.height)).getbbox()
+                boxes.append((left, top, right, bottom))
+                start = None
+        return boxes
 
     def start(self):
-        raise NotImplementedError()
+        if self.panel_state != PanelState.SLEEPING:
+            return
+        self.wake_panel()
+        self.panel_state = PanelState.AWAKE
 
     def stop(self):
-        raise NotImplementedError()
+        if self.panel_state == PanelState.SLEEPING:
+            return
+        self.sleep_panel()
+        self.panel_state = PanelState.SLEEPING
 
     def clear(self):
-        raise NotImplementedError()
+        if self.is_blank:
+            return
+        self.start()
+        self.panel_state = PanelState.DRAWING
+        try:
+            self.clear_panel()
+            self.is_blank = True
+            self.last_cleared_at = self.get_time()
+            self.updates_since_clear = 0
+            self.save_state()
+        finally:
+            self.panel_state = PanelState.AWAKE
 
     def update(self, b, ry):
+        self.start()
+        self.panel_state = PanelState.DRAWING
+        try:
+            self.is_blank = False
+            self.draw_panel(b, ry)
+            self.updates_since_clear += 1  # Saved along with the frame
+        finally:
+            self.panel_state = PanelState.AWAKE
+
+    def wake_panel(self):
+        pass
+
+    def sleep_panel(self):
+        pass
+
+    def clear_panel(self):
+        raise NotImplementedError()
+
+    def draw_panel(self, b, ry):
         raise NotImplementedError()
 
 
 class FakeEpd2in9bcDisplay(BaseDisplay):
 
-    def __init__(self):
-        super().__init__(296, 128)
+    def __init__(self, state_file: str = state_path, clock: Clock = None):
+        super().__init__(296, 128, state_file, clock)
         print(f'{self.__class__.__name__} init')
         debug_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'res', 'debug')
         self.debug_path_b = os.path.join(debug_path, 'display-b.gif')
         self.debug_path_ry = os.path.join(debug_path, 'display-ry.gif')
 
-    def start(self):
-        pass
-
-    def stop(self):
-        pass
-
-    def clear(self):
+    def clear_panel(self):
 
         try:
             os.remove(self.debug_path_b)
@@ -62,50 +226,140 @@ class FakeEpd2in9bcDisplay(BaseDisplay):
         except:
             pass
 
-    def update(self, b, ry):
+    def draw_panel(self, b, ry):
 
         b.save(self.debug_path_b)
         ry.save(self.debug_path_ry)
 
 
-class Epd2in9bcDisplay(BaseDisplay):
+class EpdDisplay(BaseDisplay):
 
-    def __init__(self):
-        self.epd = epd2in9bc.EPD()
-        super().__init__(self.epd.height, self.epd.width)  # Display always used horizontal (H x W)
+    def __init__(self, epd, state_file: str = state_path, clock: Clock = None):
+        self.epd = epd
+        super().__init__(self.epd.height, self.epd.width, state_file, clock)  # Display always used horizontal (H x W)
         self.log = logging
         self.log.basicConfig(level=logging.DEBUG)
-        self.is_initialized = False
 
-    def start(self):
-        if self.is_initialized:
-            self.log.error('Cannot start; already initialized')
-            return
-        if self.epd:
-            self.log.info('Starting')
-            self.is_initialized = True
-            self.epd.init()
-            sleep(1)
+    def wake_panel(self):
+        self.log.info('Starting')
+        if self.epd.init() != 0:  # Returns once the panel is powered on and idle
+            raise RuntimeError(f'Could not start {self.__class__.__name__}')
 
-    def stop(self):
-        if not self.is_initialized:
-            self.log.error('Cannot stop; not initialized')
-            return
-        if self.epd:
-            self.log.info('Stopping')
-            self.epd.sleep()
-            self.is_initialized = False
-            sleep(1)
+    def sleep_panel(self):
+        self.log.info('Stopping')
+        self.epd.sleep()  # The panel keeps showing its last frame while asleep
 
-    def clear(self):
-        if self.epd:
-            self.log.info('Clearing')
-            self.epd.Clear()
-            sleep(1)
 
-    def update(self, b, ry):
+class Epd2in9bcDisplay(EpdDisplay):
+
+    def __init__(self, state_file: str = state_path, clock: Clock = None):
+        super().__init__(epd2in9bc.EPD(), state_file, clock)
+
+    def clear_panel(self):
+        self.log.info('Clearing')
+        self.epd.Clear()
+
+    def draw_panel(self, b, ry):
         if self.epd and b and ry:
             self.log.info(f'Updating {self.__class__.__name__}')
             self.epd.display(self.epd.getbuffer(b), self.epd.getbuffer(ry))
+            self.log.info(f'Refreshed in {epd2in9bc.epdconfig.get_busy_ms():.0f}ms')
         else:
             self.log.error(f'Missing requirements for the display: ({self.epd}, {b}, {ry})')
+
+
+class Epd2in9dDisplay(EpdDisplay):
+    """
+    Black/white panel supporting partial refreshes: only the window around the areas that changed since the previous
+    update is refreshed, with a full refresh every config.FULL_REFRESH_EVERY_UPDATES updates to clear ghosting.
+    """
+
+    def __init__(self, state_file: str = state_path, full_refresh_every: int = config.FULL_REFRESH_EVERY_UPDATES,
+                 clock: Clock = None):
+        self.full_refresh_every = full_refresh_every
+        self.partial_updates = 0
+        self.last_frame = None  # Shown on the panel, kept next to the state file to diff against in later runs
+        self.frame_file = None if state_file is None else f'{os.path.splitext(state_file)[0]}-frame.png'
+        super().__init__(epd2in9d.EPD(), state_file, clock)
+
+    def load_state(self):
+        super().load_state()
+        self.last_frame = self.load_last_frame()
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.partial_updates = state.get('partial_updates', 0)
+
+    def get_state(self):
+        state = super().get_state()
+        state['partial_updates'] = self.partial_updates
+        return state
+
+    def load_last_frame(self):
+        if self.frame_file is None or not os.path.exists(self.frame_file):
+            return None
+        from PIL import Image
+        try:
+            with Image.open(self.frame_file) as im:
+                frame = im.convert('1')
+        except OSError:
+            print(f'Ignoring unreadable last frame in {self.frame_file}')
+            return None
+        return frame if frame.size == self.size else None
+
+    def save_last_frame(self):
+        if self.frame_file is None:
+            return
+        if self.last_frame is None:
+            if os.path.exists(self.frame_file):
+                os.remove(self.frame_file)
+            return
+        tmp_filename = f'{self.frame_file}.tmp'
+        self.last_frame.save(tmp_filename, format='PNG')
+        os.replace(tmp_filename, self.frame_file)
+
+    def can_update_partially(self):
+        return self.last_frame is not None and self.partial_updates < self.full_refresh_every
+
+    def clear_panel(self):
+        self.log.info('Clearing')
+        self.epd.Clear(0xFF)
+        self.last_frame = None
+        self.save_last_frame()
+
+    def draw_panel(self, b, ry):
+        if not (self.epd and b and ry):
+            self.log.error(f'Missing requirements for the display: ({self.epd}, {b}, {ry})')
+            return
+
+        from PIL import ImageChops
+
+        frame = ImageChops.logical_and(b, ry)  # No red plane, anything red is drawn black
+        buf = self.epd.getbuffer(frame)
+
+        if self.can_update_partially():
+            boxes = BaseDisplay.get_dirty_boxes(self.last_frame, frame)
+            self.log.info(f'Updating {self.__class__.__name__} partially ({len(boxes)} areas)')
+            if boxes:  # One window around all the areas, each refresh takes as long whatever its size
+                box = (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                       max(b[2] for b in boxes), max(b[3] for b in boxes))
+                self.epd.DisplayPartialWindow(buf, *self.get_panel_window(box))
+            self.partial_updates += 1
+            self.log.info(f'Refreshed in {epd2in9d.epdconfig.get_busy_ms():.0f}ms')
+        else:
+            self.log.info(f'Updating {self.__class__.__name__}')
+            self.epd.display(buf)
+            self.partial_updates = 0
+            self.log.info(f'Refreshed in {epd2in9d.epdconfig.get_busy_ms():.0f}ms')
+
+        self.last_frame = frame
+        self.save_last_frame()
+
+    def get_panel_window(self, box):
+        # Frames are horizontal, the panel is addressed vertically in whole bytes along x
+        left, top, right, bottom = box
+        x_start = top - top % 8
+        x_end = min(bottom + (-bottom) % 8, self.epd.width) - 1
+        y_start = self.epd.height - right
+        y_end = self.epd.height - left - 1
+        return x_start, y_start, x_end, y_end
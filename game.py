@@ -1,4 +1,5 @@
 import enum
+from dataclasses import dataclass, replace
 from datetime import datetime
 
 
@@ -13,73 +14,110 @@ class GameStatus(enum.Enum):
     POSTPONED = 9
 
 
+# Immutable records, compared and hashed by value: a new poll is equal to the previous one if nothing changed.
+# Only the fields read from the JSON are kept, the decoded JSON itself can be freed right away.
+
+
+@dataclass(frozen=True)
 class Team:
-    def __init__(self, j):
-        self.score = j['score']
+    __slots__ = ('score', 'id', 'name', 'wins', 'losses', 'ot')
+    score: int
+    id: int
+    name: str
+    wins: int
+    losses: int
+    ot: int
+
+    @staticmethod
+    def from_json(j) -> 'Team':
         meta = j['team']
-        self.id = meta['id']
-        self.name = meta['name']
         record = j['leagueRecord']
-        self.wins = record['wins']
-        self.losses = record['losses']
-
         # Playoffs have no OT record
-
-        try:
-            self.ot = record['ot']
-        except KeyError:
-            self.ot = None
+        return Team(j['score'], meta['id'], meta['name'], record['wins'], record['losses'], record.get('ot'))
 
 
+@dataclass(frozen=True)
 class GameDetailsTeam:
-    def __init__(self, j):
-        self.goalie_pulled = bool(j['goaliePulled'])
-        self.num_skaters = j['numSkaters']
-        self.in_pp = bool(j['powerPlay'])
+    __slots__ = ('goalie_pulled', 'num_skaters', 'in_pp')
+    goalie_pulled: bool
+    num_skaters: int
+    in_pp: bool
+
+    @staticmethod
+    def from_json(j) -> 'GameDetailsTeam':
+        return GameDetailsTeam(bool(j['goaliePulled']), j['numSkaters'], bool(j['powerPlay']))
 
 
+@dataclass(frozen=True)
 class GameDetails:
-    def __init__(self, j):
-        linescore = j['liveData']['linescore']
-        self.period = linescore['currentPeriod']
-        self.period_ordinal = linescore['currentPeriodOrdinal']
-        self.period_remaining = linescore['currentPeriodTimeRemaining']
-        self.strength = linescore['powerPlayStrength']
+    __slots__ = ('period', 'period_ordinal', 'period_remaining', 'strength', 'in_pp', 'pp_remaining_seconds',
+                 'home', 'away', 'in_intermission', 'intermission_remaining_seconds')
+    period: int
+    period_ordinal: str
+    period_remaining: str
+    strength: str
+    in_pp: bool
+    pp_remaining_seconds: int
+    home: GameDetailsTeam
+    away: GameDetailsTeam
+    in_intermission: bool
+    intermission_remaining_seconds: int
+
+    @staticmethod
+    def from_json(j) -> 'GameDetails':
+        # Either the linescore endpoint response or the full live feed containing it
+        linescore = j['liveData']['linescore'] if 'liveData' in j else j
         pp_info = linescore['powerPlayInfo']
-        self.in_pp = bool(pp_info['inSituation'])
-        self.pp_remaining_seconds = pp_info['situationTimeRemaining']
         teams_info = linescore['teams']
-        self.home = GameDetailsTeam(teams_info['home'])
-        self.away = GameDetailsTeam(teams_info['away'])
         intermission_info = linescore['intermissionInfo']
-        self.in_intermission = intermission_info['inIntermission']
-        self.intermission_remaining_seconds = intermission_info['intermissionTimeRemaining']
-
-
+        return GameDetails(
+            period=linescore['currentPeriod'],
+            period_ordinal=linescore['currentPeriodOrdinal'],
+            period_remaining=linescore['currentPeriodTimeRemaining'],
+            strength=linescore['powerPlayStrength'],
+            in_pp=bool(pp_info['inSituation']),
+            pp_remaining_seconds=pp_info['situationTimeRemaining'],
+            home=GameDetailsTeam.from_json(teams_info['home']),
+            away=GameDetailsTeam.from_json(teams_info['away']),
+            in_intermission=intermission_info['inIntermission'],
+            intermission_remaining_seconds=intermission_info['intermissionTimeRemaining'])
+
+
+@dataclass(frozen=True)
 class Game:
-    def __init__(self, j):
-        self.id = j['gamePk']
-        self.datetime_utc = datetime.fromisoformat(j['gameDate'].replace('Z', '+00:00'))
+    __slots__ = ('id', 'datetime_utc', 'original_status', 'status', 'link', 'home', 'away', 'details', 'is_time_tbd')
+    id: int
+    datetime_utc: datetime
+    original_status: int
+    status: GameStatus
+    link: str
+    home: Team
+    away: Team
+    details: GameDetails
+    is_time_tbd: bool
+
+    @staticmethod
+    def from_json(j) -> 'Game':
         status_code = int(j['status']['statusCode'])
-        self.original_status = status_code
         try:
-            self.status = GameStatus(status_code)
+            status = GameStatus(status_code)
         except ValueError:
-            self.status = GameStatus.UNEXPECTED
+            status = GameStatus.UNEXPECTED
 
-        self.link = j['link']
         j_teams = j['teams']
-        self.home = Team(j_teams['home'])
-        self.away = Team(j_teams['away'])
-        self.details = None
-
-        try:
-            self.is_time_tbd = bool(j['startTimeTBD'])
-        except KeyError:
-            self.is_time_tbd = False
-
-    def attach_details(self, d: GameDetails):
-        self.details = d
+        return Game(
+            id=j['gamePk'],
+            datetime_utc=datetime.fromisoformat(j['gameDate'].replace('Z', '+00:00')),
+            original_status=status_code,
+            status=status,
+            link=j['link'],
+            home=Team.from_json(j_teams['home']),
+            away=Team.from_json(j_teams['away']),
+            details=None,
+            is_time_tbd=bool(j.get('startTimeTBD', False)))
+
+    def with_details(self, d: GameDetails) -> 'Game':
+        return replace(self, details=d)
 
     def has_details(self):
         return self.details is not None
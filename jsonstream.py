@@ -0,0 +1,64 @@
+import codecs
+import json
+import re
+
+# Strings (complete, or a lone quote when cut by the end of a chunk) and structural characters, scalars are skipped
+TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|"|[{}\[\],:]')
+
+
+def extract_json(chunks, path):
+    """
+    Decodes only the object or array at path (e.g. ('liveData', 'linescore')) from a JSON document read in chunks
+    of UTF-8 bytes or text. Everything around it is scanned and discarded, never decoded nor kept in memory.
+    None in path matches any key or index, the first match in the document is returned (e.g. ('dates', None,
+    'games', 0) for the first game of the first date that has any). Returns None if the path is not in the document.
+    """
+    target = [json.dumps(p) if isinstance(p, str) else p for p in path]  # Keys are compared undecoded
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    stack = []  # [key, expecting a key] of each object, [index, None] of each array
+    captured = None
+    buf = ''
+
+    for chunk in chunks:
+        buf += decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        start = 0  # Start of what is kept from buf for the next chunk
+        capture_start = 0
+
+        for m in TOKENS.finditer(buf):
+            token = m.group()
+            if token == '"':
+                start = m.start()  # Cut string, completed by the next chunk
+                break
+            start = m.end()
+            c = token[0]
+
+            if c == '{' or c == '[':
+                if captured is None and len(stack) == len(target) \
+                        and all(t is None or t == e[0] for t, e in zip(target, stack)):
+                    captured = []
+                    capture_start = m.start()
+                    capture_depth = len(stack)
+                stack.append([None, True] if c == '{' else [0, None])
+            elif c == '}' or c == ']':
+                stack.pop()
+                if captured is not None and len(stack) == capture_depth:
+                    captured.append(buf[capture_start:m.end()])
+                    return json.loads(''.join(captured))
+            elif not stack:
+                continue
+            elif c == ',':
+                top = stack[-1]
+                if top[1] is None:
+                    top[0] += 1
+                else:
+                    top[0], top[1] = None, True
+            elif c == ':':
+                stack[-1][1] = False
+            elif stack[-1][1]:
+                stack[-1][0] = token
+
+        if captured is not None:
+            captured.append(buf[capture_start:start])
+        buf = buf[start:]
+
+    return None
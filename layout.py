@@ -1,14 +1,87 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 from enum import Enum, auto
+from functools import lru_cache
+from time import time
 from utils import FontProvider
+import hashlib
 import os
 
 
+class Geometry:
+    """
+    Result of the measure pass: the box (left, top, right, bottom) of a view and the geometries of its children.
+    Shared between frames through View.get_geometry, so never modified.
+    """
+
+    def __init__(self, box, children=()):
+        self.box = box
+        self.children = children
+
+
 class View:
 
-    def draw(self, im: Image, im_ry: Image = None):
+    geometries = {}
+    geometries_max = 32
+    is_static = False  # Drawn the same for the whole game, e.g. logos, kept in frame templates
+
+    def draw(self, im: Image, im_ry: Image = None, box=None):
+        """
+        Draws into the box (left, top, right, bottom) of the images, or the whole images if no box is given.
+        Layouts pass their children boxes of the same images, so a frame is drawn without intermediate images.
+        """
         raise NotImplementedError()
 
+    def get_structure(self):
+        # What the geometry of the view depends on besides its box, the same for trees of the same shape
+        return self.__class__.__name__
+
+    def measure(self, box) -> Geometry:
+        return Geometry(box)
+
+    def get_key(self):
+        # The data drawn by a leaf view, or None if unknown; views with the same key in the same box look the same
+        return None
+
+    def get_leaves(self, geometry: Geometry):
+        yield self, geometry.box
+
+    def get_files(self):
+        # Files the drawing depends on, a template is rebuilt when any of them changes
+        return []
+
+    def draw_geometry(self, im: Image, im_ry: Image, geometry: Geometry):
+        self.draw(im, im_ry, geometry.box)
+
+    @staticmethod
+    def get_geometry(view, box) -> Geometry:
+        # Trees rebuilt every frame have the same shape, so their geometry is measured once per shape and box
+        key = (view.get_structure(), box)
+        geometry = View.geometries.get(key)
+        if geometry is None:
+            if len(View.geometries) >= View.geometries_max:
+                View.geometries.clear()
+            geometry = view.measure(box)
+            View.geometries[key] = geometry
+        return geometry
+
+    @staticmethod
+    def get_box(im: Image, box):
+        return box if box is not None else (0, 0, im.size[0], im.size[1])
+
+    @staticmethod
+    def get_box_size(box):
+        return box[2] - box[0], box[3] - box[1]
+
+    def draw_isolated(self, im: Image, im_ry: Image, box):
+        # For views that could draw outside of their box, clipped by drawing into images of the box size
+        size = View.get_box_size(box)
+        new_image = View.create_image(size)
+        new_image_ry = View.create_image(size)
+        self.draw(new_image, new_image_ry)
+        im.paste(new_image, box[:2])
+        if im_ry is not None:
+            im_ry.paste(new_image_ry, box[:2])
+
     @staticmethod
     def create_image(size):
         return Image.new('1', size, 255)
@@ -65,25 +138,81 @@ class TextView(View):
         self.p = p
         self.inv = invert_colors
 
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def load_font(path: str, size: int):
+        return ImageFont.truetype(path, size)
+
+    def get_key(self):
+        return self.__class__.__name__, self.t, self.ms, self.inv, self.p
+
     def get_font(self, s):
-        return ImageFont.truetype(self.fp.get_font_path_filename(), s)
+        return TextView.load_font(self.fp.get_font_path_filename(), s)
 
-    def draw(self, im: Image, im_ry: Image = None):
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def fit_font_size(path: str, text: str, box: (int, int), max_size: int):
+        """
+        Largest of max_size, max_size - 2, max_size - 4... for which the text fits the box (or gets too small to
+        shrink further), binary searched as text size grows with font size.
+        Memoized, as the same strings are drawn in the same boxes frame after frame.
+        """
+        canvas = View.create_canvas(View.create_image((1, 1)))
+
+        def is_final(step):
+            text_size = canvas.textsize(text, TextView.load_font(path, max_size - step * 2))
+            return text_size[0] <= 8 or text_size[1] <= 8 \
+                or (text_size[0] <= box[0] and text_size[1] <= box[1])
+
+        low, high = (0, max(int((max_size - 1) / 2), 0))
+        while low < high:
+            mid = int((low + high) / 2)
+            if is_final(mid):
+                high = mid
+            else:
+                low = mid + 1
+        return max_size - low * 2
 
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def measure_text(path: str, text: str, box: (int, int), max_size: int):
+        """
+        Font size and size of the text drawn in the box, and the box of its ink relative to where it is drawn:
+        glyphs can reach past the text size by a few pixels. Only measured again when the text changes.
+        """
+        font_size = TextView.fit_font_size(path, text, box, max_size)
+        font = TextView.load_font(path, font_size)
+        canvas = View.create_canvas(View.create_image((1, 1)))
+        text_size = canvas.textsize(text, font)
+
+        margin = font_size
+        im = View.create_image((text_size[0] + margin * 2, text_size[1] + margin * 2))
+        View.create_canvas(im).multiline_text((margin, margin), text, fill=0, font=font, align='center')
+        ink = ImageChops.invert(im.convert('L')).getbbox()
+        if ink is None:
+            return font_size, text_size, (0, 0, 0, 0)
+        return font_size, text_size, tuple(edge - margin for edge in ink)
+
+    def draw(self, im: Image, im_ry: Image = None, box=None):
+
+        size = View.get_box_size(View.get_box(im, box))
         canvas = View.create_canvas(im)
-        font_size = self.ms
+        font_size, text_size, ink = TextView.measure_text(self.fp.get_font_path_filename(), self.t, size, self.ms)
         font = self.get_font(font_size)
-        text_size = canvas.textsize(self.t, font)
-        while text_size[0] > 8 and text_size[1] > 8 \
-                and (text_size[0] > im.size[0] or text_size[1] > im.size[1]):
-            font_size -= 2
-            font = self.get_font(font_size)
-            text_size = canvas.textsize(self.t, font)
 
-        xy = View.xy(im.size, text_size, self.p)
+        left, top, right, bottom = View.get_box(im, box)
+        xy = View.xy(size, text_size, self.p)
+        xy = (left + xy[0], top + xy[1])
+
+        if box is not None and (text_size[0] > size[0] or text_size[1] > size[1]
+                                or xy[0] + ink[0] < left or xy[1] + ink[1] < top
+                                or xy[0] + ink[2] > right or xy[1] + ink[3] > bottom):
+            self.draw_isolated(im, im_ry, box)  # Too long to fit even when shrunk, or glyphs reaching past the box
+            return
 
         bg_fill = 0 if self.inv else 255
-        canvas.rectangle((xy, (xy[0] + text_size[0], xy[1] + text_size[1])), fill=bg_fill)
+        bg_end = (min(xy[0] + text_size[0], right - 1), min(xy[1] + text_size[1], bottom - 1))
+        canvas.rectangle((xy, bg_end), fill=bg_fill)
 
         text_fill = 255 if self.inv else 0
         canvas.multiline_text(xy, self.t, fill=text_fill, font=font, align='center')
@@ -91,30 +220,61 @@ class TextView(View):
 
 class ImagePathView(View):
 
+    is_static = True
+
     def __init__(self, im_path: str, im_ry_path: str, p=View.center_center):
         self.im_path = im_path
         self.im_ry_path = im_ry_path
         self.p = p
 
-    def draw(self, im: Image, im_ry: Image = None):
-        _im_b = Image.open(self.im_path)
-        new_max_size = (int(min(im.size[0], _im_b.size[0])), int(min(im.size[1], _im_b.size[1])))
-        _im_b.thumbnail(new_max_size)
+    def get_key(self):
+        return self.__class__.__name__, self.im_path, self.im_ry_path, self.p
+
+    def get_files(self):
+        return [self.im_path, self.im_ry_path]
+
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def get_scaled_image(path: str, max_size: (int, int)):
+        """
+        Decoded 1-bit image scaled down to fit max_size, or None if there is no such file.
+        Cached by path and size, as the same logos are drawn in the same boxes on every frame.
+        """
+        if not os.path.exists(path):
+            return None
+        with Image.open(path) as _im:
+            _im.thumbnail((min(max_size[0], _im.size[0]), min(max_size[1], _im.size[1])))
+            return _im.convert('1')
+
+    def draw(self, im: Image, im_ry: Image = None, box=None):
+        box = View.get_box(im, box)
+        size = View.get_box_size(box)
+        _im_b = ImagePathView.get_scaled_image(self.im_path, size)
+        if _im_b is None:
+            raise FileNotFoundError(self.im_path)
         new_size = _im_b.size
-        xy = View.xy(im.size, new_size, self.p)
+        xy = View.xy(size, new_size, self.p)
+        xy = (box[0] + xy[0], box[1] + xy[1])
         im.paste(_im_b, xy)
-        _im_b.close()
 
-        if im_ry is not None and os.path.exists(self.im_ry_path):
-            _im_ry = Image.open(self.im_ry_path)
-            _im_ry.thumbnail(new_size)
-            im_ry.paste(_im_ry, xy)
-            _im_ry.close()
+        if im_ry is not None:
+            _im_ry = ImagePathView.get_scaled_image(self.im_ry_path, new_size)
+            if _im_ry is not None:
+                im_ry.paste(_im_ry, xy)
 
 
 class MissingDataView(View):
 
-    def draw(self, im: Image, im_ry: Image = None):
+    is_static = True
+
+    def get_key(self):
+        return self.__class__.__name__
+
+    def draw(self, im: Image, im_ry: Image = None, box=None):
+        if box is not None:
+            self.draw_isolated(im, im_ry, box)  # Border lines are clipped by the edges
+            return
+
         canvas = View.create_canvas(im)
         fill = 0
         width = 3
@@ -134,17 +294,25 @@ class SpacingLayout(View):
         self.s = spacing_percent
         self.c = child
 
-    def draw(self, im: Image, im_ry: Image = None):
-        x_space = int(im.size[0] * self.s)
-        y_space = int(im.size[1] * self.s)
-        xy = (x_space, y_space)
-        new_size = (int(im.size[0] - (x_space * 2)), int(im.size[1] - (y_space * 2)))
-        new_image = View.create_image(new_size)
-        new_image_ry = View.create_image(new_size)
-        self.c.draw(new_image, new_image_ry)
-        im.paste(new_image, xy)
-        if im_ry is not None:
-            im_ry.paste(new_image_ry, xy)
+    def get_structure(self):
+        return self.__class__.__name__, self.s, self.c.get_structure()
+
+    def measure(self, box) -> Geometry:
+        w, h = View.get_box_size(box)
+        x_space = int(w * self.s)
+        y_space = int(h * self.s)
+        x, y = (box[0] + x_space, box[1] + y_space)
+        new_size = (int(w - (x_space * 2)), int(h - (y_space * 2)))
+        return Geometry(box, (self.c.measure((x, y, x + new_size[0], y + new_size[1])),))
+
+    def get_leaves(self, geometry: Geometry):
+        return self.c.get_leaves(geometry.children[0])
+
+    def draw_geometry(self, im: Image, im_ry: Image, geometry: Geometry):
+        self.c.draw_geometry(im, im_ry, geometry.children[0])
+
+    def draw(self, im: Image, im_ry: Image = None, box=None):
+        self.draw_geometry(im, im_ry, View.get_geometry(self, View.get_box(im, box)))
 
 
 class LinearLayout(View):
@@ -168,10 +336,15 @@ class LinearLayout(View):
         for w in weights:
             self.weights_total += w
 
-    def draw(self, im: Image, im_ry: Image = None):
+    def get_structure(self):
+        children = tuple(c.get_structure() for c in self.children)
+        return self.__class__.__name__, tuple(self.weights), self.is_vertical, children
 
-        x, y = (0, 0)
-        w, h = im.size
+    def measure(self, box) -> Geometry:
+
+        children = []
+        x, y = box[:2]
+        w, h = View.get_box_size(box)
         for i in range(len(self.children)):
             c = self.children[i]
             percent = self.weights[i] / self.weights_total
@@ -185,12 +358,144 @@ class LinearLayout(View):
                 new_w = int(percent * w)
                 new_size = (new_w, h)
 
-            new_image = View.create_image(new_size)
-            new_image_ry = View.create_image(new_size)
-            c.draw(new_image, new_image_ry)
-            im.paste(new_image, (x, y))
-            if im_ry is not None:
-                im_ry.paste(new_image_ry, (x, y))
+            children.append(c.measure((x, y, x + new_size[0], y + new_size[1])))
             x += new_w
             y += new_h
-            del c, percent, new_w, new_h, new_size, new_image, new_image_ry
+
+        return Geometry(box, tuple(children))
+
+    def get_leaves(self, geometry: Geometry):
+        for c, child_geometry in zip(self.children, geometry.children):
+            yield from c.get_leaves(child_geometry)
+
+    def draw_geometry(self, im: Image, im_ry: Image, geometry: Geometry):
+        for c, child_geometry in zip(self.children, geometry.children):
+            c.draw_geometry(im, im_ry, child_geometry)
+
+    def draw(self, im: Image, im_ry: Image = None, box=None):
+        self.draw_geometry(im, im_ry, View.get_geometry(self, View.get_box(im, box)))
+
+
+class TemplateCache:
+    """
+    Frames with only the static views drawn, shared by every frame of the same screen for a matchup and kept on
+    disk for later runs. Keyed by a hash of the screen shape, the static views and the files they draw.
+    """
+
+    def __init__(self, path: str, max_in_memory: int = 8):
+        self.path = path
+        self.templates = {}
+        self.max_in_memory = max_in_memory
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def get_file_hash(path: str):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    @staticmethod
+    def get_template_key(shape, static_leaves):
+        parts = [repr(shape)]
+        for leaf, box in static_leaves:
+            parts.append(repr((leaf.get_key(), box)))
+            parts.extend(str(TemplateCache.get_file_hash(f)) for f in leaf.get_files())
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+    def get_template(self, shape, static_leaves, size):
+        key = TemplateCache.get_template_key(shape, static_leaves)
+        template = self.templates.get(key)
+        if template is None:
+            template = self.load(key)
+        if template is None:
+            template = (View.create_image(size), View.create_image(size))
+            for leaf, box in static_leaves:
+                leaf.draw(template[0], template[1], box)
+            self.save(key, template)
+
+        if len(self.templates) >= self.max_in_memory:
+            self.templates.clear()
+        self.templates[key] = template
+        return template
+
+    def get_filenames(self, key):
+        return os.path.join(self.path, f'{key}-b.png'), os.path.join(self.path, f'{key}-ry.png')
+
+    def load(self, key):
+        filenames = self.get_filenames(key)
+        if not all(os.path.exists(f) for f in filenames):
+            return None
+        try:
+            images = []
+            for f in filenames:
+                with Image.open(f) as im:
+                    images.append(im.convert('1'))
+                os.utime(f)  # Still in use, kept by prune()
+            return images[0], images[1]
+        except OSError:
+            return None
+
+    def save(self, key, template):
+        for im, f in zip(template, self.get_filenames(key)):
+            tmp_filename = f'{f}.tmp'
+            im.save(tmp_filename, format='PNG')
+            os.replace(tmp_filename, f)
+
+    def prune(self, max_age_seconds):
+        for f in os.listdir(self.path):
+            filename = os.path.join(self.path, f)
+            if os.path.isfile(filename) and time() - os.path.getmtime(filename) > max_age_seconds:
+                os.remove(filename)
+
+
+class Renderer:
+    """
+    Draws whole frames, reusing the previous frame when the view tree has the same shape: only the leaf views
+    whose key changed (e.g. a score or the clock) are drawn again, logos and records are copied over.
+    Leaf views never draw outside of their box, so clearing the box of a changed leaf clears all it drew before.
+    Otherwise frames start from a template with the static views already drawn, if there is a template cache.
+    """
+
+    def __init__(self, templates: TemplateCache = None):
+        self.templates = templates
+        self.last_shape = None
+        self.last_keys = None
+        self.last_im = None
+        self.last_im_ry = None
+        self.redrawn = 0  # Leaf views drawn for the last frame
+
+    def draw(self, view: View, im: Image, im_ry: Image):
+        geometry = View.get_geometry(view, View.get_box(im, None))
+        leaves = list(view.get_leaves(geometry))
+        keys = [leaf.get_key() for leaf, _ in leaves]
+        shape = (view.get_structure(), im.size)
+
+        incremental = shape == self.last_shape
+        from_template = not incremental and self.templates is not None
+        if incremental:
+            im.paste(self.last_im)
+            im_ry.paste(self.last_im_ry)
+        elif from_template:
+            template = self.templates.get_template(shape, [l for l in leaves if l[0].is_static], im.size)
+            im.paste(template[0])
+            im_ry.paste(template[1])
+
+        self.redrawn = 0
+        for i in range(len(leaves)):
+            leaf, box = leaves[i]
+            if from_template and leaf.is_static:
+                continue
+            if incremental:
+                if keys[i] is not None and keys[i] == self.last_keys[i]:
+                    continue
+                for _im in [im, im_ry]:
+                    View.create_canvas(_im).rectangle((box[:2], (box[2] - 1, box[3] - 1)), fill=255)
+            leaf.draw(im, im_ry, box)
+            self.redrawn += 1
+
+        self.last_shape = shape
+        self.last_keys = keys
+        self.last_im = im
+        self.last_im_ry = im_ry
@@ -30,8 +30,7 @@
 
 import logging
 from . import epdconfig
-from PIL import Image
-import RPi.GPIO as GPIO
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 128
@@ -168,12 +167,16 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_data_bulk(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
         
     def ReadBusy(self):
         logging.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            self.send_command(0x71)
-            epdconfig.delay_ms(100)  
+        epdconfig.wait_busy(self.busy_pin, 1, poll=lambda: self.send_command(0x71))      # 0: busy, 1: idle
         logging.debug("e-Paper busy release")
     def TurnOnDisplay(self):
         self.send_command(0x12)
@@ -262,38 +265,15 @@ class EPD:
             self.send_data(self.lut_bb1[count])
 
     def getbuffer(self, image):
-        # logging.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logging.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logging.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logging.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.getbuffer(image, self.width, self.height)
 
     def display(self, image):
         self.send_command(0x10)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0x00)
+        self.send_data_bulk([0x00] * int(self.width * self.height / 8))
         epdconfig.delay_ms(10)
         
         self.send_command(0x13)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(image[i])
+        self.send_data_bulk(image[:int(self.width * self.height / 8)])
         epdconfig.delay_ms(10)
         
         self.SetFullReg()
@@ -319,20 +299,48 @@ class EPD:
         
         self.send_command(0x13)
         for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(~image[i])
+            self.send_data(image[i] ^ 0xFF)  # Inverts the byte within 0-255
         epdconfig.delay_ms(10)
-          
+
         self.TurnOnDisplay()
-        
+
+    # Partial refresh of the window x_start..x_end, y_start..y_end (inclusive) of a full frame buffer.
+    # x_start must be a multiple of 8 and x_end one less than a multiple of 8.
+    def DisplayPartialWindow(self, image, x_start, y_start, x_end, y_end):
+        self.SetPartReg()
+        self.send_command(0x91)
+        self.send_command(0x90)
+        self.send_data(x_start)
+        self.send_data(x_end)
+
+        self.send_data(int(y_start / 256))
+        self.send_data(y_start % 256)
+        self.send_data(int(y_end / 256))
+        self.send_data(y_end % 256)
+        self.send_data(0x28)
+
+        linewidth = int(self.width / 8)
+        window = []
+        for y in range(y_start, y_end + 1):
+            window.extend(image[y * linewidth + int(x_start / 8):y * linewidth + int(x_end / 8) + 1])
+
+        self.send_command(0x10)
+        self.send_data_bulk(window)
+        epdconfig.delay_ms(10)
+
+        self.send_command(0x13)
+        self.send_data_bulk([data ^ 0xFF for data in window])
+        epdconfig.delay_ms(10)
+
+        self.TurnOnDisplay()
+
     def Clear(self, color):
         self.send_command(0x10)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0x00)
+        self.send_data_bulk([0x00] * int(self.width * self.height / 8))
         epdconfig.delay_ms(10)
         
         self.send_command(0x13)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
+        self.send_data_bulk([0xFF] * int(self.width * self.height / 8))
         epdconfig.delay_ms(10)
         
         self.SetFullReg()
@@ -0,0 +1,29 @@
+import logging
+
+
+def getbuffer(image, width, height):
+    """
+    Packs a PIL image into the 1 bit per pixel, MSB first buffer the panels expect (1: white, 0: black).
+    Horizontal images (height x width) are rotated into the panel's native vertical orientation.
+    Rows are padded to whole bytes with white, as the drivers using a 'linewidth' do.
+    """
+    from PIL import Image  # Only needed once there's an image to send, not to import the drivers
+
+    linewidth = (width + 7) // 8
+    image_monocolor = image.convert('1')
+    imwidth, imheight = image_monocolor.size
+
+    if imwidth == width and imheight == height:
+        logging.debug("Vertical")
+    elif imwidth == height and imheight == width:
+        logging.debug("Horizontal")
+        image_monocolor = image_monocolor.transpose(Image.ROTATE_90)
+    else:
+        return bytearray([0xFF] * (linewidth * height))
+
+    if width % 8 != 0:
+        padded = Image.new('1', (linewidth * 8, height), 255)
+        padded.paste(image_monocolor, (0, 0))
+        image_monocolor = padded
+
+    return bytearray(image_monocolor.tobytes())
@@ -31,14 +31,81 @@ import os
 import logging
 import sys
 import time
+from contextlib import contextmanager
+from importlib.util import find_spec
 
+# Pin definition, the same on every implementation
+RST_PIN         = 17
+DC_PIN          = 25
+CS_PIN          = 8
+BUSY_PIN        = 24
 
-class RaspberryPi:
+BUSY_TIMEOUT_MS = 30000  # Longer than any refresh, the tri-color panels take about 15s
+BUSY_EDGE_SLICE_MS = 500  # Bounds the wait if the edge came right before waiting for it
+BUSY_POLL_MS = (5, 100)  # Polling interval without edge detection, doubled from min to max
+
+
+class Implementation:
+    """
+    Waiting on the BUSY pin, shared by every implementation: on the GPIO library's edge detection where it is
+    supported, otherwise polling with a growing interval. The time of the last wait is kept as a metric.
+    """
+    busy_ms = 0
+    busy_total_ms = 0
+
+    def now_ms(self):
+        return time.monotonic() * 1000
+
+    def wait_for_edge(self, pin, idle, timeout_ms):
+        # Returns False if edge detection is not available, to poll instead
+        edge = self.GPIO.RISING if idle else self.GPIO.FALLING
+        start = self.now_ms()
+        try:
+            while self.digital_read(pin) != idle:
+                remaining_ms = timeout_ms - (self.now_ms() - start)
+                if remaining_ms <= 0:
+                    break
+                self.GPIO.wait_for_edge(pin, edge, timeout=int(min(remaining_ms, BUSY_EDGE_SLICE_MS)) + 1)
+        except (RuntimeError, AttributeError) as e:
+            logging.debug(f"No edge detection on the busy pin, polling instead: {e}")
+            return False
+        return True
+
+    def wait_busy(self, pin, idle=1, timeout_ms=BUSY_TIMEOUT_MS, poll=None):
+        # poll: called before every read, e.g. the get status command some controllers need, which rules out edges
+        start = self.now_ms()
+        if self.digital_read(pin) != idle and not (poll is None and self.wait_for_edge(pin, idle, timeout_ms)):
+            interval = BUSY_POLL_MS[0]
+            while True:
+                if poll is not None:
+                    poll()
+                if self.digital_read(pin) == idle:
+                    break
+                if self.now_ms() - start > timeout_ms:
+                    break
+                self.delay_ms(interval)
+                interval = min(interval * 2, BUSY_POLL_MS[1])
+
+        self.busy_ms = self.now_ms() - start
+        self.busy_total_ms += self.busy_ms
+        if self.busy_ms > timeout_ms:
+            logging.warning(f"e-Paper still busy after {self.busy_ms:.0f}ms, giving up")
+        return self.busy_ms
+
+    def get_busy_ms(self):
+        return self.busy_ms
+
+
+class RaspberryPi(Implementation):
     # Pin definition
-    RST_PIN         = 17
-    DC_PIN          = 25
-    CS_PIN          = 8
-    BUSY_PIN        = 24
+    RST_PIN         = RST_PIN
+    DC_PIN          = DC_PIN
+    CS_PIN          = CS_PIN
+    BUSY_PIN        = BUSY_PIN
+
+    @staticmethod
+    def is_available():
+        return find_spec('spidev') is not None and find_spec('RPi') is not None
 
     def __init__(self):
         import spidev
@@ -46,8 +113,8 @@ class RaspberryPi:
 
         self.GPIO = RPi.GPIO
 
-        # SPI device, bus = 0, device = 0
-        self.SPI = spidev.SpiDev(0, 0)
+        # SPI device, opened as bus = 0, device = 0 by module_init
+        self.SPI = spidev.SpiDev()
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -61,6 +128,10 @@ class RaspberryPi:
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
+    def spi_writebyte2(self, data):
+        # writebytes2 streams buffers of any length, splitting them by the spidev bufsiz
+        self.SPI.writebytes2(data)
+
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
         self.GPIO.setwarnings(False)
@@ -68,6 +139,7 @@ class RaspberryPi:
         self.GPIO.setup(self.DC_PIN, self.GPIO.OUT)
         self.GPIO.setup(self.CS_PIN, self.GPIO.OUT)
         self.GPIO.setup(self.BUSY_PIN, self.GPIO.IN)
+        self.SPI.open(0, 0)  # Reopened on every init, module_exit closes it
         self.SPI.max_speed_hz = 4000000
         self.SPI.mode = 0b00
         return 0
@@ -83,28 +155,36 @@ class RaspberryPi:
         self.GPIO.cleanup()
 
 
-class JetsonNano:
+class JetsonNano(Implementation):
     # Pin definition
-    RST_PIN         = 17
-    DC_PIN          = 25
-    CS_PIN          = 8
-    BUSY_PIN        = 24
+    RST_PIN         = RST_PIN
+    DC_PIN          = DC_PIN
+    CS_PIN          = CS_PIN
+    BUSY_PIN        = BUSY_PIN
 
-    def __init__(self):
-        import ctypes
+    @staticmethod
+    def find_spi_library():
         find_dirs = [
             os.path.dirname(os.path.realpath(__file__)),
             '/usr/local/lib',
             '/usr/lib',
         ]
-        self.SPI = None
         for find_dir in find_dirs:
             so_filename = os.path.join(find_dir, 'sysfs_software_spi.so')
             if os.path.exists(so_filename):
-                self.SPI = ctypes.cdll.LoadLibrary(so_filename)
-                break
-        if self.SPI is None:
+                return so_filename
+        return None
+
+    @staticmethod
+    def is_available():
+        return JetsonNano.find_spi_library() is not None and find_spec('Jetson') is not None
+
+    def __init__(self):
+        import ctypes
+        so_filename = JetsonNano.find_spi_library()
+        if so_filename is None:
             raise RuntimeError('Cannot find sysfs_software_spi.so')
+        self.SPI = ctypes.cdll.LoadLibrary(so_filename)
 
         import Jetson.GPIO
         self.GPIO = Jetson.GPIO
@@ -121,6 +201,10 @@ class JetsonNano:
     def spi_writebyte(self, data):
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
+    def spi_writebyte2(self, data):
+        for byte in data:
+            self.SPI.SYSFS_software_spi_transfer(byte)
+
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
         self.GPIO.setwarnings(False)
@@ -142,13 +226,203 @@ class JetsonNano:
         self.GPIO.cleanup()
 
 
+class Simulated(Implementation):
+    """
+    No hardware: records every command and data byte sent to the panel, rebuilds its RAM planes from the
+    0x10/0x13 streams (partial windows included) and models the BUSY pin on a simulated clock, so drivers can
+    be verified bit-exact and timed without a panel. Nothing sleeps, delays only move the clock.
+    """
+    # Pin definition
+    RST_PIN         = RST_PIN
+    DC_PIN          = DC_PIN
+    CS_PIN          = CS_PIN
+    BUSY_PIN        = BUSY_PIN
+
+    # Time (ms) the panel stays busy after each command, approximated from the Waveshare specs
+    BUSY_MS = {
+        'epd2in9bc': {0x04: 100, 0x12: 15000, 0x02: 50},
+        'epd2in9d': {0x04: 100, 0x12: 2000, 'partial': 300, 0x02: 50},
+    }
+    SPI_BYTE_MS = 8 / 4000  # 4MHz, as set up by RaspberryPi
+    SPI_TRANSACTION_MS = 0.05  # Per write call
+    GPIO_READ_MS = 0.01
+
+    @staticmethod
+    def is_available():
+        return False  # There is no hardware, only used when asked for
+
+    def __init__(self, panel='epd2in9bc', width=128, height=296):
+        self.panel_busy_ms = Simulated.BUSY_MS[panel]
+        self.linewidth = (width + 7) // 8
+        self.height = height
+        self.planes = {0x10: bytearray([0xFF] * (self.linewidth * height)),
+                       0x13: bytearray([0xFF] * (self.linewidth * height))}
+        self.time_ms = 0
+        self.busy_until_ms = 0
+        self.busy_wait_ms = 0  # Spent reading BUSY while the panel was busy
+        self.transactions = 0
+        self.commands = []
+        self.data = []
+        self.refreshes = []  # (time_ms, partial window or None) of every 0x12
+        self.is_open = False
+        self.dc = 0
+        self.command = None
+        self.params = []
+        self.window = None  # (x_start, y_start, x_end, y_end) set by 0x90
+        self.is_partial = False
+        self.positions = iter(())
+
+    def digital_write(self, pin, value):
+        if pin == self.DC_PIN:
+            self.dc = value
+        elif pin == self.RST_PIN and value == 0:
+            self.is_partial = False
+
+    def digital_read(self, pin):
+        self.time_ms += Simulated.GPIO_READ_MS
+        if pin == self.BUSY_PIN and self.time_ms < self.busy_until_ms:
+            self.busy_wait_ms += Simulated.GPIO_READ_MS
+            return 0  # 0: busy, 1: idle
+        return 1
+
+    def delay_ms(self, delaytime):
+        if self.time_ms < self.busy_until_ms:
+            self.busy_wait_ms += min(delaytime, self.busy_until_ms - self.time_ms)
+        self.time_ms += delaytime
+
+    def spi_writebyte(self, data):
+        self.spi_writebyte2(data)
+
+    def spi_writebyte2(self, data):
+        self.transactions += 1
+        self.time_ms += Simulated.SPI_TRANSACTION_MS + len(data) * Simulated.SPI_BYTE_MS
+        for byte in data:
+            if not 0 <= byte <= 0xFF:
+                raise ValueError(f'Not a byte: {byte}')
+            if self.dc:
+                self.data.append(byte)
+                self.write_data(byte)
+            else:
+                self.commands.append(byte)
+                self.write_command(byte)
+
+    def write_command(self, command):
+        self.command = command
+        self.params = []
+        if command == 0x91:
+            self.is_partial = True
+        elif command == 0x92:
+            self.is_partial = False
+        elif command in self.planes:
+            self.positions = self.get_positions()
+        elif command == 0x12:
+            self.refreshes.append((self.time_ms, self.window if self.is_partial else None))
+
+        busy_ms = self.panel_busy_ms.get('partial' if command == 0x12 and self.is_partial else command)
+        if busy_ms is not None:
+            self.busy_until_ms = self.time_ms + busy_ms
+
+    def write_data(self, byte):
+        if self.command in self.planes:
+            position = next(self.positions, None)
+            if position is not None:
+                self.planes[self.command][position] = byte
+        elif self.command == 0x90:
+            self.params.append(byte)
+            if len(self.params) == 6:
+                p = self.params
+                self.window = (p[0], p[2] * 256 + p[3], p[1], p[4] * 256 + p[5])
+
+    def now_ms(self):
+        return self.time_ms
+
+    def wait_for_edge(self, pin, idle, timeout_ms):
+        # Wakes up right when the panel is done
+        if pin == self.BUSY_PIN and idle == 1:
+            self.delay_ms(max(0, min(self.busy_until_ms - self.time_ms, timeout_ms)))
+            return True
+        return False
+
+    def get_positions(self):
+        # Offsets into a plane the next data bytes are written to, row by row within the partial window if any
+        if self.is_partial and self.window is not None:
+            x_start, y_start, x_end, y_end = self.window
+            for y in range(y_start, y_end + 1):
+                for x in range(x_start // 8, x_end // 8 + 1):
+                    yield y * self.linewidth + x
+        else:
+            yield from range(len(self.planes[0x10]))
+
+    def get_plane(self, command):
+        return bytes(self.planes[command])
+
+    def get_image(self, command):
+        # The plane as a 1 bit image in the panel's vertical orientation (1: white, 0: black)
+        from PIL import Image
+        return Image.frombytes('1', (self.linewidth * 8, self.height), self.get_plane(command))
+
+    def module_init(self):
+        self.is_open = True
+        return 0
+
+    def module_exit(self):
+        self.is_open = False
+
+
 if os.path.exists('/sys/bus/platform/drivers/gpiomem-bcm2835'):
-    implementation = RaspberryPi()
+    implementation_class = RaspberryPi
+elif JetsonNano.find_spi_library() is not None:
+    implementation_class = JetsonNano
 else:
-    implementation = JetsonNano()
+    implementation_class = Simulated  # No hardware, e.g. a dev box or CI
+
+implementation = None
+bound_functions = []  # Functions of the implementation copied to this module, so drivers call them directly
+
+
+def is_available():
+    # Whether the hardware libraries can be found, without importing them
+    return implementation_class.is_available()
+
+
+def use(impl):
+    """
+    Sends everything to impl from now on, e.g. a Simulated panel, and returns the implementation used until now.
+    Only the functions drivers call are replaced, not the ones of this module (e.g. is_available). With None,
+    the hardware implementation is created again on first use.
+    """
+    global implementation, bound_functions
+    previous = implementation
+    module = sys.modules[__name__]
+    for func in bound_functions:
+        delattr(module, func)
+
+    implementation = impl
+    bound_functions = [x for x in dir(impl) if not x.startswith('_') and callable(getattr(impl, x))
+                       and x not in MODULE_FUNCTIONS] if impl is not None else []
+    for func in bound_functions:
+        setattr(module, func, getattr(impl, func))
+    return previous
+
+
+@contextmanager
+def using(impl):
+    # Sends everything to impl within the block only, e.g. a Simulated panel in a test
+    previous = use(impl)
+    try:
+        yield impl
+    finally:
+        use(previous)
+
+
+MODULE_FUNCTIONS = ['is_available', 'use', 'using']
+
 
-for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+def __getattr__(name):
+    # The hardware libraries are only imported once a function is first used (e.g. module_init), not on import
+    if implementation is None:
+        use(implementation_class())
+    return getattr(implementation, name)
 
 
 ### END OF FILE ###
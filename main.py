@@ -2,55 +2,121 @@
 # -*- coding:utf-8 -*-
 import config
 # noinspection PyUnresolvedReferences
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from display import get_display
-from utils import LogoProvider, FontProvider
-from ui import get_ui_builder, GameStatus
+from utils import LogoProvider, FontProvider, Clock, get_seconds_until_next_update, get_game_hash, \
+    get_code_version, get_timezone
+from game import GameStatus
 from time import sleep
+from functools import lru_cache
+import argparse
 import os
-import pytz
 from net import NhlApi, DebugNhlApi, NoUpcomingGameError
+from cache import ResponseCache
 
 curr_dir = os.path.dirname(os.path.realpath(__file__))
 
-if config.DEBUG_ENABLED is True:
-    debugGame = os.path.join(curr_dir, config.DEBUG_GAME)
-    debugDetails = os.path.join(curr_dir, config.DEBUG_GAME_DETAILS) if config.DEBUG_GAME_DETAILS is not None else None
-    api = DebugNhlApi(debugGame, debugDetails)
-else:
-    api = NhlApi(config.CHECK_LIMIT_DAYS)
 
-res_path = os.path.join(curr_dir, 'res')
-fp = FontProvider(res_path)
-lp = LogoProvider(api.abbrs, res_path)
+def get_api(clock: Clock):
+    if config.DEBUG_ENABLED is True:
+        debug_game = os.path.join(curr_dir, config.DEBUG_GAME)
+        debug_details = os.path.join(curr_dir, config.DEBUG_GAME_DETAILS) \
+            if config.DEBUG_GAME_DETAILS is not None else None
+        return DebugNhlApi(debug_game, debug_details, clock)
+    else:
+        cache = ResponseCache(os.path.join(curr_dir, config.API_CACHE_DIR), config.API_CACHE_TTL_SECONDS, clock)
+        cache.prune(max(config.API_CACHE_TTL_SECONDS.values()))
+        return NhlApi(config.CHECK_LIMIT_DAYS, config.API_TIMEOUTS, config.API_RETRIES, cache, clock)
+
+
+@lru_cache(maxsize=1)
+def get_renderer():
+    # Created for the first frame to draw and kept across frames, so a frame only redraws what changed since
+    # the previous one, in the live loop as with --daemon
+    from layout import Renderer, TemplateCache
+    templates = TemplateCache(os.path.join(curr_dir, config.TEMPLATE_CACHE_DIR))
+    templates.prune(config.TEMPLATE_CACHE_MAX_AGE_SECONDS)
+    return Renderer(templates)
 
-fav_team_id = api.get_team_id(config.FAVORITE_TEAM)
-game_date = datetime.today().astimezone(tz=pytz.timezone(config.TIMEZONE))
 
-# Loop if the game is live
-while True:
+def update(d, fp, lp, api, fav_team_id, clock: Clock, renderer=None):
 
     game = None
+    game_date = clock.now(get_timezone(config.TIMEZONE))
     try:
         game = api.get_next_game(fav_team_id, game_date)  # -/+ timedelta(days=1)
     except NoUpcomingGameError:
         print('No upcoming game was found')
 
-    is_live = game is not None \
-        and (GameStatus.LIVE == game.status
-             or GameStatus.LIVE_CRITICAL == game.status)
+    game_hash = get_game_hash(game, game_date.date(), get_code_version(curr_dir))
+    if d.is_game_unchanged(game_hash):
+        d.skip_frame()
+        print(f'Game unchanged, skipping render ({d.skipped_frames} skipped so far)')
+        return game
 
-    d = get_display()
-    d.start()
-    d.clear()
-
-    try:
-        get_ui_builder(d, fp, lp, game) \
-            .deploy()
-    finally:
-        d.stop()
+    # PIL and the views are only imported once there is a frame to draw
+    from ui import get_ui_builder
+    renderer = renderer if renderer is not None else get_renderer()
+    ui = get_ui_builder(d, fp, lp, game, clock, renderer)
 
-    if is_live is True:
-        sleep(config.CHECK_UPDATE_LIVE_GAME_SECONDS)
+    if d.is_frame_unchanged(ui.b, ui.ry):
+        d.skip_frame()
+        print(f'Frame unchanged, skipping display refresh ({d.skipped_frames} skipped so far)')
     else:
-        break
+        d.start()
+        if d.needs_clear():
+            d.clear()
+
+        try:
+            ui.deploy()
+        finally:
+            d.stop()
+
+    d.set_last_game(game_hash)
+    return game
+
+
+def run(daemon=False, clock: Clock = None):
+
+    clock = clock if clock is not None else Clock()
+    api = get_api(clock)
+
+    res_path = os.path.join(curr_dir, 'res')
+    fp = FontProvider(res_path)
+    lp = LogoProvider(api.abbrs, res_path)
+
+    fav_team_id = api.get_team_id(config.FAVORITE_TEAM)
+    d = get_display(clock)
+
+    # Loop if the game is live, or forever as a daemon
+    while True:
+
+        if daemon:
+            try:
+                game = update(d, fp, lp, api, fav_team_id, clock)
+                seconds = get_seconds_until_next_update(game, clock.now(timezone.utc),
+                                                        get_timezone(config.TIMEZONE))
+            except Exception as e:
+                print(f'Update failed, retrying later: {e}')
+                seconds = config.CHECK_UPDATE_LIVE_GAME_SECONDS
+            print(f'Next update in {seconds}s')
+            sleep(seconds)
+            continue
+
+        game = update(d, fp, lp, api, fav_team_id, clock)
+
+        is_live = game is not None \
+            and (GameStatus.LIVE == game.status
+                 or GameStatus.LIVE_CRITICAL == game.status)
+
+        if is_live is True:
+            sleep(config.CHECK_UPDATE_LIVE_GAME_SECONDS)
+        else:
+            break
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and schedule each update from the state of the game')
+    run(parser.parse_args().daemon)
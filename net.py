@@ -1,22 +1,37 @@
 import json
 import requests
 import os
-from utils import write_file, read_file
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils import read_file, Clock
+from cache import ResponseCache
+from jsonstream import extract_json
 from game import Game, GameStatus, GameDetails
 from datetime import datetime, timedelta
-from time import sleep
 
 API_BASE_URL = 'http://statsapi.web.nhl.com'
 API_SCHEDULE = 'api/v1/schedule'
 API_TEAMS = 'api/v1/teams'
+API_GAME_LINESCORE = 'api/v1/game/{}/linescore'
 API_DATE_FORMAT = '%Y-%m-%d'
+API_STREAM_CHUNK_SIZE = 16 * 1024
+
+# Parts of the responses read into the model, the rest is discarded while streaming
+SCHEDULE_FIRST_GAME_PATH = ('dates', None, 'games', 0)  # Dates without games (e.g. a day off) are skipped
+FEED_LINESCORE_PATH = ('liveData', 'linescore')
+
+TEAMS_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'teams.json')
 
 
 class NhlApi:
 
-    def __init__(self, check_limit_days: int = 3):
-        self.timeouts = (60, 60)
+    def __init__(self, check_limit_days: int = 3, timeouts: (float, float) = (10, 30), retries: int = 3,
+                 cache: ResponseCache = None, clock: Clock = None):
+        self.clock = clock if clock is not None else Clock()
+        self.timeouts = timeouts  # (connect, read) seconds, per attempt
         self.check_limit = check_limit_days
+        self.session = NhlApi.create_session(retries)
+        self.cache = cache
         teams = NhlApi.get_teams_data(self)
         self.abbrs = self.__get_teams_abbreviations(teams)
 
@@ -31,26 +46,75 @@ class NhlApi:
 
     def get_teams_data(self):
 
-        # Check for existing local data
-        filename = 'teams.json'
+        url = NhlApi.build_url(API_TEAMS)
 
-        for f in [f'../{filename}', filename]:
-            if os.path.exists(f):
-                print(f'Teams data exists in {f}')
-                return json.loads(read_file(f))
+        # The bundled teams data is used as is without a cache, or as its first entry, refreshed once stale
+        if os.path.exists(TEAMS_FILE):
+            if self.cache is None:
+                return json.loads(read_file(TEAMS_FILE))
+            if self.cache.get(url) is None:
+                print(f'Seeding teams data from {TEAMS_FILE}')
+                self.cache.put(url, read_file(TEAMS_FILE))
 
-        print('Fetching teams data')
-        url = NhlApi.build_url(API_TEAMS)
-        res = self.get(url)
-        if res:
-            text = res.text
-            write_file(filename, text)
-            return json.loads(text)
-        else:
-            raise Exception('No teams data available')
+        entry = self.cache.get(url) if self.cache is not None else None
+        if entry is None or not self.cache.is_fresh(entry):
+            print('Fetching teams data')
+        return self.get_json(url)
 
-    def get(self, url):
-        return requests.get(url, timeout=self.timeouts)
+    @staticmethod
+    def create_session(retries: int) -> requests.Session:
+        # One pooled keep-alive connection reused by every request, retrying failures with backoff (1s, 2s, 4s...)
+        retry = Retry(total=retries, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip'})
+        return session
+
+    def get(self, url, headers=None, stream=False):
+        return self.session.get(url, headers=headers, timeout=self.timeouts, stream=stream)
+
+    @staticmethod
+    def read_json(res: requests.Response, path=None):
+        if path is None:
+            return json.loads(res.content)
+        # Only the part at path is decoded, the response is read in chunks and never held whole
+        with res:
+            chunks = res.iter_content(API_STREAM_CHUNK_SIZE)
+            j = extract_json(chunks, path)
+            for _ in chunks:  # Read to the end, so the connection can be reused
+                pass
+            return j
+
+    def get_json(self, url, path=None):
+
+        if self.cache is None:
+            res = self.get(url, stream=path is not None)
+            res.raise_for_status()
+            return NhlApi.read_json(res, path)
+
+        # Cached responses are only what was read from them
+        cache_url = url if path is None else f'{url}#{".".join(str(p) for p in path)}'
+        entry = self.cache.get(cache_url)
+        if entry is not None and self.cache.is_fresh(entry):
+            return json.loads(entry.body)
+
+        try:
+            res = self.get(url, entry.get_validators() if entry is not None else None, stream=path is not None)
+            if res.status_code == 304 and entry is not None:
+                res.close()
+                entry = self.cache.touch(entry)
+            else:
+                res.raise_for_status()
+                body = json.dumps(NhlApi.read_json(res, path)) if path is not None else res.text
+                entry = self.cache.put(cache_url, body, res.headers.get('ETag'), res.headers.get('Last-Modified'))
+        except requests.RequestException as e:
+            if entry is None:
+                raise
+            print(f'Using cached response from {int(self.cache.get_age(entry))}s ago ({e})')
+
+        return json.loads(entry.body)
 
     @staticmethod
     def __get_teams_abbreviations(teams_data):
@@ -67,60 +131,71 @@ class NhlApi:
                 return key
         raise Exception('Team abbreviation is incorrect')
 
-    def __get_game_details(self, link: str) -> GameDetails:
-        res = self.get(NhlApi.build_url(link))
-        return GameDetails(json.loads(res.content))
-
-    def get_next_game(self, tid, date_time=datetime.today(), loop=0):
-        while loop < self.check_limit:
-            team_arg = f'teamId={tid}'
-            date_arg = f'date={date_time.strftime(API_DATE_FORMAT)}'
-
-            url = NhlApi.build_url(API_SCHEDULE, team_arg, date_arg)
-            res = self.get(url)
-            data = json.loads(res.content)
-
-            count = data['totalGames']
-            if count > 0:
+    def __get_game_details(self, game: Game) -> GameDetails:
 
-                game = Game(data['dates'][0]['games'][0])
+        # The linescore is all GameDetails needs, a fraction of the size of the live feed
+        try:
+            return GameDetails.from_json(self.get_json(NhlApi.build_url(API_GAME_LINESCORE.format(game.id))))
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f'No linescore available, falling back to the live feed ({e})')
 
-                if GameStatus.LIVE == game.status \
-                        or GameStatus.LIVE_CRITICAL == game.status \
-                        or GameStatus.FINAL == game.status:
+        return GameDetails.from_json(self.get_json(NhlApi.build_url(game.link), FEED_LINESCORE_PATH))
 
-                    details = self.__get_game_details(game.link)
-                    game.attach_details(details)
-                return game
-            else:
-                seconds = 1
-                print(f'No games, checking next day in {seconds}s... ({loop})')
-                sleep(seconds)
-                return self.get_next_game(tid, date_time + timedelta(days=1), loop + 1)
-        raise NoUpcomingGameError()
+    @staticmethod
+    def get_first_game(data):
+        for date in data['dates']:
+            for j in date['games']:
+                return Game.from_json(j)
+        return None
+
+    def get_next_game(self, tid, date_time: datetime = None):
+
+        if date_time is None:
+            date_time = self.clock.now()
+
+        # A single schedule request covering the whole range of days to check
+        start_date = date_time.strftime(API_DATE_FORMAT)
+        end_date = (date_time + timedelta(days=max(self.check_limit, 1) - 1)).strftime(API_DATE_FORMAT)
+        url = NhlApi.build_url(API_SCHEDULE, f'teamId={tid}', f'startDate={start_date}', f'endDate={end_date}')
+        j = self.get_json(url, SCHEDULE_FIRST_GAME_PATH)
+
+        if j is None:
+            print(f'No games between {start_date} and {end_date}')
+            raise NoUpcomingGameError()
+
+        game = Game.from_json(j)
+        if GameStatus.LIVE == game.status \
+                or GameStatus.LIVE_CRITICAL == game.status \
+                or GameStatus.FINAL == game.status:
+
+            details = self.__get_game_details(game)
+            game = game.with_details(details)
+        return game
 
 
 class DebugNhlApi(NhlApi):
 
-    def __init__(self, local_game_data, local_game_data_details=None):
-        super().__init__()
+    def __init__(self, local_game_data, local_game_data_details=None, clock: Clock = None):
+        super().__init__(clock=clock)
         if local_game_data is None:
             raise ValueError(local_game_data)
         self.game = local_game_data
         self.details = local_game_data_details
 
-    def get_next_game(self, tid, date_time=datetime.today(), loop=0):
+    def get_next_game(self, tid, date_time: datetime = None):
 
         g = open(self.game)
         data = json.loads(g.read())
         g.close()
-        game = Game(data['dates'][0]['games'][0])
+        game = NhlApi.get_first_game(data)
+        if game is None:
+            raise NoUpcomingGameError()
 
         if self.details is not None:
             d = open(self.details)
-            details = GameDetails(json.loads(d.read()))
+            details = GameDetails.from_json(json.loads(d.read()))
             d.close()
-            game.attach_details(details)
+            game = game.with_details(details)
 
         return game
 
@@ -3,4 +3,5 @@ from display import *
 display = get_display()
 display.start()
 display.clear()
+display.forget_last_frame()
 display.stop()
@@ -0,0 +1,236 @@
+import argparse
+import gc
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from display import FakeEpd2in9bcDisplay
+from jsonstream import extract_json
+from net import NhlApi, API_STREAM_CHUNK_SIZE, SCHEDULE_FIRST_GAME_PATH, FEED_LINESCORE_PATH
+from game import Game, GameDetails
+from layout import Renderer
+from ui import NoGame, ScheduledGame, ScheduledTimeTbdGame, PostponedGame, LiveGame, FinalGame, UnexpectedGame
+from utils import LogoProvider, FontProvider
+from waveshare_epd import epdbuffer, epdconfig, epd2in9bc, epd2in9d
+
+STARTUP_IMPORT_BUDGET_MS = 400  # Importing main, without PIL or the hardware libraries
+STARTUP_LAZY_MODULES = ['PIL', 'ui', 'layout', 'spidev', 'RPi', 'Jetson']  # Imported only when needed
+
+RENDER_BASELINE_FILE = 'benchmarks.baseline.json'
+RENDER_STAGES = ['parse', 'build', 'draw', 'pack']
+RENDER_TIME_TOLERANCE = (2.0, 1.0)  # Slower than twice the baseline plus 1ms is a regression
+RENDER_PEAK_TOLERANCE = 1.2
+
+
+def get_import_times(module, cwd='..'):
+    # Cumulative import time (us) of each module loaded by importing the given one, in a fresh interpreter
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def benchmark_startup():
+    # Time (ms) to import main
+    times = get_import_times('main')
+    heaviest = sorted(((t, m) for m, t in times.items() if m != 'main'), reverse=True)[:5]
+    print(f'import main: {times["main"] / 1000:.1f}ms (budget {STARTUP_IMPORT_BUDGET_MS}ms), heaviest: '
+          + ', '.join(f'{m} {t / 1000:.1f}ms' for t, m in heaviest))
+    return times['main'] / 1000
+
+
+def get_parse_peaks(filename, path):
+    # Peak traced memory (bytes) reading the response at filename streamed, then whole as before
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+
+    tracemalloc.start()
+    extract_json((data[i:i + API_STREAM_CHUNK_SIZE] for i in range(0, len(data), API_STREAM_CHUNK_SIZE)), path)
+    _, streamed = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    json.loads(data)
+    _, loaded = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return streamed, loaded
+
+
+def benchmark_parse(filename, path):
+    streamed, loaded = get_parse_peaks(filename, path)
+    print(f'{filename}: {streamed / 1024:.1f}KiB peak streamed, {loaded / 1024:.1f}KiB loaded whole')
+
+
+class TimedRenderer(Renderer):
+    """
+    Renderer adding up the time spent drawing, the rest of a builder's time is spent building its view tree.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.elapsed = 0
+
+    def draw(self, view, im, im_ry):
+        start = time.perf_counter()
+        super().draw(view, im, im_ry)
+        self.elapsed += time.perf_counter() - start
+
+
+def get_render_cases():
+    # (name, builder, schedule fixture, feed fixture) for every builder and fixture
+    games = sorted(glob.glob('tests.games.*.json'))
+    feeds = sorted(glob.glob('tests.game.*.json'))
+    cases = [('NoGame', NoGame, None, None)]
+    for builder in [ScheduledGame, ScheduledTimeTbdGame, PostponedGame, FinalGame, UnexpectedGame]:
+        for games_file in games:
+            cases.append((f'{builder.__name__} {games_file}', builder, games_file, None))
+    for builder in [LiveGame, FinalGame]:
+        for feed_file in feeds:
+            cases.append((f'{builder.__name__} {feed_file}', builder, 'tests.games.live.json', feed_file))
+    return cases
+
+
+def read_bytes(filename):
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+    return data
+
+
+def get_chunks(data):
+    return (data[i:i + API_STREAM_CHUNK_SIZE] for i in range(0, len(data), API_STREAM_CHUNK_SIZE))
+
+
+def render_case(builder, games_data, feed_data, d, fp, lp):
+    # One poll as main.py does it, from the responses to the panel buffers. Returns the seconds spent in each stage
+    start = time.perf_counter()
+    g = None
+    if games_data is not None:
+        g = Game.from_json(extract_json(get_chunks(games_data), SCHEDULE_FIRST_GAME_PATH))
+    if feed_data is not None:
+        g = g.with_details(GameDetails.from_json(extract_json(get_chunks(feed_data), FEED_LINESCORE_PATH)))
+    parsed = time.perf_counter()
+
+    renderer = TimedRenderer()  # Every frame drawn whole, as on a cold start
+    ui = builder(d, fp, renderer=renderer) if g is None else builder(d, g, fp, lp, renderer=renderer)
+    built = time.perf_counter()
+
+    epdbuffer.getbuffer(ui.b, d.size[1], d.size[0])
+    epdbuffer.getbuffer(ui.ry, d.size[1], d.size[0])
+    packed = time.perf_counter()
+
+    return {'parse': parsed - start, 'build': built - parsed - renderer.elapsed, 'draw': renderer.elapsed,
+            'pack': packed - built}
+
+
+def benchmark_renders(cases=None, repeat=5):
+    """
+    Times each stage of every case (best of repeat, in ms) and the peak traced memory of one run (in KiB),
+    against the fake display so it runs anywhere.
+    """
+    d = FakeEpd2in9bcDisplay(state_file=None)
+    fp = FontProvider('../res')
+    lp = LogoProvider(NhlApi().abbrs, '../res')
+
+    results = {}
+    for name, builder, games_file, feed_file in cases if cases is not None else get_render_cases():
+        games_data = read_bytes(games_file) if games_file is not None else None
+        feed_data = read_bytes(feed_file) if feed_file is not None else None
+        render_case(builder, games_data, feed_data, d, fp, lp)  # Warm up caches
+
+        gc.disable()  # As timeit does, collections would land on whichever stage happens to trigger them
+        runs = [render_case(builder, games_data, feed_data, d, fp, lp) for _ in range(repeat)]
+        gc.enable()
+        result = {stage: min(run[stage] for run in runs) * 1000 for stage in RENDER_STAGES}
+
+        tracemalloc.start()
+        render_case(builder, games_data, feed_data, d, fp, lp)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['peak'] = peak / 1024
+        results[name] = result
+
+    return results
+
+
+def get_render_regressions(results, baseline):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        for stage in RENDER_STAGES:
+            if result[stage] > base[stage] * RENDER_TIME_TOLERANCE[0] + RENDER_TIME_TOLERANCE[1]:
+                regressions.append(f'{name}: {stage} {result[stage]:.2f}ms, baseline {base[stage]:.2f}ms')
+        if result['peak'] > base['peak'] * RENDER_PEAK_TOLERANCE:
+            regressions.append(f'{name}: peak {result["peak"]:.1f}KiB, baseline {base["peak"]:.1f}KiB')
+    return regressions
+
+
+def benchmark_panels():
+    # Simulated time and SPI writes of each panel operation, as the drivers send them
+    for name, driver, operation in [
+            ('epd2in9bc display', epd2in9bc, lambda epd, buf: epd.display(buf, buf)),
+            ('epd2in9bc Clear', epd2in9bc, lambda epd, buf: epd.Clear()),
+            ('epd2in9d display', epd2in9d, lambda epd, buf: epd.display(buf)),
+            ('epd2in9d DisplayPartialWindow', epd2in9d, lambda epd, buf: epd.DisplayPartialWindow(buf, 0, 0, 15, 63))]:
+        sim = epdconfig.Simulated(driver.__name__.split('.')[-1])
+        driver.epdconfig = sim
+        try:
+            epd = driver.EPD()
+            operation(epd, bytes(epd.width // 8 * epd.height))
+        finally:
+            driver.epdconfig = epdconfig
+        print(f'{name}: {sim.time_ms:.0f}ms simulated ({sim.busy_wait_ms:.0f}ms busy), {sim.transactions} SPI writes')
+
+
+def print_renders(results):
+    print(f'{"":64}' + ''.join(f'{stage:>8}' for stage in RENDER_STAGES) + f'{"peak":>10}')
+    for name, result in results.items():
+        print(f'{name:64}' + ''.join(f'{result[stage]:>6.2f}ms' for stage in RENDER_STAGES)
+              + f'{result["peak"]:>7.1f}KiB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--save-baseline', action='store_true', help=f'Save the results to {RENDER_BASELINE_FILE}')
+    parser.add_argument('--check', action='store_true', help=f'Fail on regressions from {RENDER_BASELINE_FILE}')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    startup = benchmark_startup()
+    for filename in sorted(glob.glob('tests.game.*.json')):
+        benchmark_parse(filename, FEED_LINESCORE_PATH)
+    benchmark_parse('tests.games.live.json', SCHEDULE_FIRST_GAME_PATH)
+    benchmark_panels()
+
+    results = benchmark_renders(repeat=args.repeat)
+    print_renders(results)
+    print(f'Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}KiB')
+
+    if args.save_baseline:
+        with open(RENDER_BASELINE_FILE, 'w') as f:
+            f.write(json.dumps(results, indent=2))
+        print(f'Saved baseline to {RENDER_BASELINE_FILE}')
+
+    if args.check:
+        if not os.path.exists(RENDER_BASELINE_FILE):
+            sys.exit('No baseline, run with --save-baseline first')
+        with open(RENDER_BASELINE_FILE, 'r') as f:
+            regressions = get_render_regressions(results, json.loads(f.read()))
+        if startup > STARTUP_IMPORT_BUDGET_MS:
+            regressions.append(f'import main: {startup:.1f}ms, budget {STARTUP_IMPORT_BUDGET_MS}ms')
+        for regression in regressions:
+            print(f'Regression, {regression}')
+        sys.exit(1 if len(regressions) > 0 else 0)
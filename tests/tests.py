@@ -2,16 +2,33 @@ import unittest
 import main
 import json
 from ui import *
-from net import NhlApi
-from datetime import datetime, timedelta
-from display import get_display
-from utils import LogoProvider, FontProvider
+from net import NhlApi, NoUpcomingGameError, SCHEDULE_FIRST_GAME_PATH, FEED_LINESCORE_PATH
+from cache import ResponseCache
+from jsonstream import extract_json
+from datetime import datetime, timedelta, timezone
+from display import get_display, FakeEpd2in9bcDisplay, Epd2in9bcDisplay, Epd2in9dDisplay, BaseDisplay, \
+    PanelState
+from utils import LogoProvider, FontProvider, Clock, get_game_hash, get_code_version
+from layout import Renderer, TemplateCache
+from benchmarks import get_import_times, get_parse_peaks, STARTUP_LAZY_MODULES, benchmark_renders, \
+    get_render_cases, get_render_regressions
 from ui import get_ui_builder
 import os
-import pytz
+from dataclasses import replace
+import random
+from time import perf_counter
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageDraw
+from waveshare_epd import epdbuffer, epd2in9bc, epd2in9d, epdconfig
 
 
 class MyTestCase(unittest.TestCase):
+    def tearDown(self):
+        epd2in9bc.epdconfig = epdconfig
+        epd2in9d.epdconfig = epdconfig
+
     def test_url_endpoint(self):
         url = NhlApi.build_url('test')
         self.assertIsNotNone(url)
@@ -25,6 +42,20 @@ class MyTestCase(unittest.TestCase):
         url = NhlApi.build_url('test', 'k1=v1', 'a=b')
         self.assertTrue(url.endswith('/test?k1=v1&a=b'))
 
+    def test_first_game_in_range(self):
+        f = open('tests.games.scheduled.json', 'r')
+        data = json.loads(f.read())
+        f.close()
+        first = data['dates'][0]
+        data['dates'].insert(0, {'date': '2020-01-31', 'totalGames': 0, 'games': []})
+        data['dates'].append(first)
+
+        g = NhlApi.get_first_game(data)
+        self.assertEqual(first['games'][0]['gamePk'], g.id)
+
+    def test_first_game_in_empty_range(self):
+        self.assertIsNone(NhlApi.get_first_game({'totalGames': 0, 'dates': []}))
+
     def test_json_parsing(self):
         g = get_game_from_file('tests.games.live.json')
         # Game data
@@ -82,7 +113,7 @@ class MyTestCase(unittest.TestCase):
         # Diff makes it one day apart US Pacific:
         now_utc = g.datetime_utc - timedelta(hours=11)
 
-        day, time, tz = utils.get_friendly_game_time(g, now_utc, pytz.timezone('US/Pacific'))
+        day, time, tz = utils.get_friendly_game_time(g, now_utc, utils.get_timezone('US/Pacific'))
 
         self.assertEqual('Tomorrow', day)
         self.assertEqual('10:00AM', time)  # As defined in the input test file
@@ -93,7 +124,7 @@ class MyTestCase(unittest.TestCase):
         # Diff makes it one day apart US Pacific:
         now_utc = g.datetime_utc - timedelta(days=1, hours=9)
 
-        day, time, tz = utils.get_friendly_game_time(g, now_utc, pytz.timezone('US/Pacific'))
+        day, time, tz = utils.get_friendly_game_time(g, now_utc, utils.get_timezone('US/Pacific'))
 
         self.assertEqual('Tomorrow', day)
         self.assertEqual('10:00AM', time)  # As defined in the input test file
@@ -103,7 +134,7 @@ class MyTestCase(unittest.TestCase):
         g = get_game_from_file('tests.games.scheduled.json')
         # Diff over 2 day US Eastern:
         now_utc = g.datetime_utc - timedelta(days=5)
-        day, time, tz = utils.get_friendly_game_time(g, now_utc, pytz.timezone('US/Eastern'))
+        day, time, tz = utils.get_friendly_game_time(g, now_utc, utils.get_timezone('US/Eastern'))
 
         self.assertEqual('Sat, Feb/01', day)
         self.assertEqual('7:00PM', time)  # As defined in the input test file
@@ -113,12 +144,51 @@ class MyTestCase(unittest.TestCase):
         g = get_game_from_file('tests.games.scheduled.json')
         # Diff is not strictly 48 hours but still day after tomorrow for US Pacific timezone:
         now_utc = g.datetime_utc - timedelta(hours=45)
-        day, time, tz = utils.get_friendly_game_time(g, now_utc, pytz.timezone('US/Pacific'))
+        day, time, tz = utils.get_friendly_game_time(g, now_utc, utils.get_timezone('US/Pacific'))
 
         self.assertEqual('Sat, Feb/01', day)
         self.assertEqual('4:00PM', time)  # As defined in the input test file
         self.assertEqual('PST', tz)  # As no tz was provided
 
+    def test_timezone_cached(self):
+        self.assertIs(utils.get_timezone('US/Pacific'), utils.get_timezone('US/Pacific'))
+        self.assertEqual('PDT', datetime(2020, 7, 1, tzinfo=utils.get_timezone('US/Pacific')).strftime('%Z'))
+
+    def test_next_update_live(self):
+        g = get_game_from_file('tests.games.live.json')
+        seconds = utils.get_seconds_until_next_update(g, g.datetime_utc, live_seconds=30)
+        self.assertEqual(30, seconds)
+
+    def test_next_update_scheduled_puck_drop(self):
+        g = get_game_from_file('tests.games.scheduled.json')
+        now_utc = g.datetime_utc - timedelta(hours=2)
+        seconds = utils.get_seconds_until_next_update(g, now_utc, utils.get_timezone('US/Eastern'))
+        self.assertEqual(2 * 60 * 60, seconds)
+
+    def test_next_update_scheduled_delayed(self):
+        g = get_game_from_file('tests.games.scheduled.json')
+        now_utc = g.datetime_utc + timedelta(minutes=5)
+        seconds = utils.get_seconds_until_next_update(g, now_utc, live_seconds=30)
+        self.assertEqual(30, seconds)
+
+    def test_next_update_scheduled_next_morning(self):
+        g = get_game_from_file('tests.games.scheduled.json')
+        # Game is Sat, Feb/01 7:00PM EST, now is Wed 5:00PM EST
+        now_utc = g.datetime_utc - timedelta(days=3, hours=2)
+        seconds = utils.get_seconds_until_next_update(g, now_utc, utils.get_timezone('US/Eastern'))
+        self.assertEqual(15 * 60 * 60, seconds)  # Until 8:00AM
+
+    def test_next_update_final_next_morning(self):
+        g = get_game_from_file('tests.games.final.json')
+        now_utc = datetime(2020, 2, 1, 6, 30, tzinfo=timezone.utc)  # 1:30AM EST
+        seconds = utils.get_seconds_until_next_update(g, now_utc, utils.get_timezone('US/Eastern'))
+        self.assertEqual(int(6.5 * 60 * 60), seconds)
+
+    def test_next_update_no_game(self):
+        now_utc = datetime(2020, 2, 1, 20, 0, tzinfo=timezone.utc)
+        seconds = utils.get_seconds_until_next_update(None, now_utc)
+        self.assertEqual(12 * 60 * 60, seconds)
+
     def test_live_period(self):
         d = get_detailed_game_from_file('tests.game.period1.pp.json')
 
@@ -145,6 +215,17 @@ class MyTestCase(unittest.TestCase):
         self.assertFalse(d.home.goalie_pulled)
         self.assertFalse(d.away.goalie_pulled)
 
+    def test_live_linescore_only(self):
+        f = open('tests.game.period1.pp.json', 'r')
+        linescore = json.loads(f.read())['liveData']['linescore']
+        f.close()
+        d = GameDetails.from_json(linescore)
+
+        self.assertEqual('1st', d.period_ordinal)
+        self.assertEqual('04:11', d.period_remaining)
+        self.assertTrue(d.in_pp)
+        self.assertTrue(d.home.in_pp)
+
     def test_live_nointermission(self):
         d1 = get_detailed_game_from_file('tests.game.4on4.json')
 
@@ -191,19 +272,735 @@ class MyTestCase(unittest.TestCase):
         formatted = utils.pp_seconds_to_friendly(seconds)
         self.assertEqual('5:00', formatted)
 
+    def test_epd_buffer_vertical(self):
+        w, h = (128, 296)
+        im = get_random_image((w, h))
+        self.assertEqual(get_reference_buffer(im, w, h), bytes(epdbuffer.getbuffer(im, w, h)))
+
+    def test_epd_buffer_horizontal(self):
+        w, h = (128, 296)
+        im = get_random_image((h, w))
+        self.assertEqual(get_reference_buffer(im, w, h), bytes(epdbuffer.getbuffer(im, w, h)))
+
+    def test_epd_buffer_unpadded_width(self):
+        w, h = (122, 250)
+        im = get_random_image((h, w))
+        buf = epdbuffer.getbuffer(im, w, h)
+        self.assertEqual(16 * h, len(buf))
+        for y in range(h):
+            self.assertEqual(0b111111, buf[y * 16 + 15] & 0b111111)  # Padding bits stay white
+
+    def test_epd_buffer_unexpected_size(self):
+        buf = epdbuffer.getbuffer(get_random_image((10, 10)), 128, 296)
+        self.assertEqual(bytes([0xFF] * (16 * 296)), bytes(buf))
+
+    def test_epd_display_bulk_transfer(self):
+        sim = epdconfig.Simulated()
+        epd = get_simulated_epd(sim)
+        b = epdbuffer.getbuffer(get_random_image((296, 128)), epd.width, epd.height)
+        ry = bytes([0xFF] * len(b))
+        epd.display(b, ry)
+
+        self.assertEqual(5, sim.transactions)  # 0x10, black plane, 0x13, red plane, 0x12
+        self.assertEqual([0x10, 0x13, 0x12], sim.commands)
+        self.assertEqual(bytes(b) + ry, bytes(sim.data))
+
+    def test_epd_clear_bulk_transfer(self):
+        sim = epdconfig.Simulated()
+        epd = get_simulated_epd(sim)
+        epd.Clear()
+
+        self.assertEqual(5, sim.transactions)
+        self.assertEqual(bytes([0xFF] * (2 * 16 * 296)), bytes(sim.data))
+
+    def test_simulated_display(self):
+        sim = epdconfig.Simulated('epd2in9bc')
+        epd2in9bc.epdconfig = sim
+        d = Epd2in9bcDisplay(state_file=None)
+        b, ry = (get_random_image((296, 128)), get_random_image((128, 296)).rotate(90, expand=True))
+        d.update(b, ry)
+
+        # Frames rebuilt from the 0x10/0x13 streams, rotated back from the panel's vertical orientation
+        self.assertEqual(b.tobytes(), sim.get_image(0x10).transpose(Image.ROTATE_270).tobytes())
+        self.assertEqual(ry.tobytes(), sim.get_image(0x13).transpose(Image.ROTATE_270).tobytes())
+        self.assertEqual([None], [window for _, window in sim.refreshes])
+        # Woken up by the busy pin edge right as power on and the refresh end, without any polling overshoot
+        self.assertEqual(100 + 15000, sim.busy_wait_ms)
+
+    def test_display_lifecycle(self):
+        sim = epdconfig.Simulated('epd2in9bc')
+        epd2in9bc.epdconfig = sim
+        d = Epd2in9bcDisplay(state_file=None)
+        b, ry = (Image.new('1', d.size, 255), Image.new('1', d.size, 255))
+
+        start = perf_counter()
+        d.start()
+        d.start()
+        self.assertEqual(PanelState.AWAKE, d.panel_state)
+        d.clear()
+        d.clear()  # Already blank
+        d.update(b, ry)
+        d.stop()
+        d.stop()
+        self.assertLess(perf_counter() - start, 1)  # Waits only on BUSY, in simulated time here
+
+        self.assertEqual(PanelState.SLEEPING, d.panel_state)
+        self.assertEqual([1, 2, 1], [sim.commands.count(c) for c in [0x04, 0x12, 0x07]])  # Power on, refresh, sleep
+
+        d.update(b, ry)  # Woken up to draw
+        self.assertEqual(PanelState.AWAKE, d.panel_state)
+        self.assertEqual(2, sim.commands.count(0x04))
+
+    def test_simulated_partial_display(self):
+        sim = epdconfig.Simulated('epd2in9d')
+        epd2in9d.epdconfig = sim
+        d = Epd2in9dDisplay(state_file=None)
+        b, ry = (Image.new('1', d.size, 255), Image.new('1', d.size, 255))
+        d.update(b, ry)
+        self.assertEqual(d.epd.getbuffer(b), sim.get_plane(0x13))
+
+        ImageDraw.Draw(b).rectangle((10, 20, 12, 30), fill=0)
+        d.update(b, ry)
+        window = sim.refreshes[-1][1]
+        self.assertEqual(d.get_panel_window((10, 20, 13, 31)), window)
+
+        # The window, and only the window, was written with the new frame
+        x_start, y_start, x_end, y_end = window
+        buf = d.epd.getbuffer(b)
+        plane = sim.get_plane(0x10)
+        for y in range(d.epd.height):
+            row = slice(y * 16 + x_start // 8, y * 16 + x_end // 8 + 1)
+            if y_start <= y <= y_end:
+                self.assertEqual(buf[row], plane[row])
+            else:
+                self.assertEqual(bytes(x_end // 8 - x_start // 8 + 1), plane[row])  # 0x00 from the full update
+        self.assertAlmostEqual(2000 + 300, sim.busy_wait_ms, delta=200)
+
+    def test_epdconfig_using(self):
+        is_available = epdconfig.is_available
+        previous = epdconfig.implementation
+        sim = epdconfig.Simulated('epd2in9bc')
+
+        with epdconfig.using(sim):
+            self.assertIs(sim, epdconfig.implementation)
+            self.assertEqual(sim.digital_write, epdconfig.digital_write)
+            self.assertIs(is_available, epdconfig.is_available)
+        self.assertIs(previous, epdconfig.implementation)
+        self.assertIs(is_available, epdconfig.is_available)
+
+        display_simulated = config.DISPLAY_SIMULATED
+        try:
+            config.DISPLAY_SIMULATED = True
+            self.assertIsInstance(get_display(), Epd2in9bcDisplay)
+            self.assertIsInstance(epdconfig.implementation, epdconfig.Simulated)
+        finally:
+            config.DISPLAY_SIMULATED = display_simulated
+            epdconfig.use(previous)
+        self.assertIs(previous, epdconfig.implementation)
+
+    def test_busy_wait_on_edge(self):
+        sim = epdconfig.Simulated('epd2in9bc')
+        epd = get_simulated_epd(sim)
+        epd.Clear()
+        self.assertEqual(15000, sim.get_busy_ms())  # Woken up when done, not on the next 200ms poll
+        epd.sleep()
+        self.assertEqual(15050, sim.busy_total_ms)
+
+    def test_busy_wait_gpio_edge(self):
+        gpio = FakeGpio(busy_reads=3)
+        pi = epdconfig.RaspberryPi.__new__(epdconfig.RaspberryPi)  # Without importing the GPIO libraries
+        pi.GPIO = gpio
+        pi.wait_busy(epdconfig.BUSY_PIN, 1)
+        self.assertEqual([(epdconfig.BUSY_PIN, gpio.RISING)] * 2, [call[:2] for call in gpio.edge_waits])
+
+        # Edge detection unavailable, e.g. already in use: polled with a growing interval
+        gpio = FakeGpio(busy_reads=5, edges=False)
+        pi.GPIO = gpio
+        delays = []
+        pi.delay_ms = delays.append
+        pi.wait_busy(epdconfig.BUSY_PIN, 1)
+        self.assertEqual([5, 10, 20], delays)
+
+    def test_busy_wait_timeout(self):
+        sim = epdconfig.Simulated()
+        sim.busy_until_ms = 10 ** 9  # Never done
+        with self.assertLogs(level='WARNING'):
+            busy_ms = sim.wait_busy(epdconfig.BUSY_PIN, 1, timeout_ms=1000, poll=lambda: None)
+        self.assertAlmostEqual(1000, busy_ms, delta=100)
+
+    def test_display_frame_unchanged_across_runs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = os.path.join(tmp, 'state.json')
+            b, ry = (get_random_image((296, 128)), get_random_image((128, 296)).rotate(90, expand=True))
+
+            d1 = FakeEpd2in9bcDisplay(state_file)
+            self.assertFalse(d1.is_frame_unchanged(b, ry))
+            d1.set_last_frame(b, ry)
+
+            d2 = FakeEpd2in9bcDisplay(state_file)
+            self.assertTrue(d2.is_frame_unchanged(b, ry))
+            self.assertFalse(d2.is_frame_unchanged(ry, b))
+            d2.skip_frame()
+
+            d3 = FakeEpd2in9bcDisplay(state_file)
+            self.assertEqual(1, d3.skipped_frames)
+            d3.forget_last_frame()
+            self.assertFalse(FakeEpd2in9bcDisplay(state_file).is_frame_unchanged(b, ry))
+
+    def test_display_dirty_boxes(self):
+        old = Image.new('1', (296, 128), 255)
+        new = old.copy()
+        canvas = ImageDraw.Draw(new)
+        canvas.rectangle((10, 20, 12, 30), fill=0)
+        canvas.point((200, 5), fill=0)
+        canvas.point((201, 100), fill=0)
+
+        self.assertEqual([], BaseDisplay.get_dirty_boxes(old, old))
+        self.assertEqual([(10, 20, 13, 31), (200, 5, 202, 101)], BaseDisplay.get_dirty_boxes(old, new))
+
+    def test_partial_display_updates(self):
+        sim = epdconfig.Simulated('epd2in9d')
+        epd2in9d.epdconfig = sim
+        d = Epd2in9dDisplay(state_file=None, full_refresh_every=1)
+        b, ry = (Image.new('1', d.size, 255), Image.new('1', d.size, 255))
+
+        self.assertFalse(d.can_update_partially())
+        d.update(b, ry)
+        self.assertNotIn(0x90, sim.commands)
+
+        self.assertTrue(d.can_update_partially())
+        ImageDraw.Draw(ry).rectangle((10, 20, 12, 30), fill=0)
+        ImageDraw.Draw(ry).rectangle((200, 5, 202, 40), fill=0)  # Apart from the first area, refreshed together
+        transactions = sim.transactions
+        d.update(b, ry)
+        self.assertEqual(1, sim.commands.count(0x90))
+        x_start, y_start, x_end, y_end = sim.refreshes[-1][1]
+        self.assertEqual(d.get_panel_window((10, 5, 203, 41)), (x_start, y_start, x_end, y_end))
+        window_bytes = (x_end - x_start + 1) // 8 * (y_end - y_start + 1)
+        self.assertLess(sim.transactions - transactions, window_bytes)  # Planes sent in bulk, not byte by byte
+        self.assertEqual((16, 283, 31, 285), d.get_panel_window((10, 20, 13, 31)))
+
+        self.assertFalse(d.can_update_partially())  # Full refresh due after 1 partial one
+
+    def test_partial_display_across_runs(self):
+        with tempfile.TemporaryDirectory() as path:
+            state_file = os.path.join(path, 'display-state.json')
+            sim = epdconfig.Simulated('epd2in9d')
+            epd2in9d.epdconfig = sim
+            d = Epd2in9dDisplay(state_file, full_refresh_every=2)
+            b, ry = (Image.new('1', d.size, 255), Image.new('1', d.size, 255))
+            d.update(b, ry)
+            d.set_last_frame(b, ry)
+
+            d2 = Epd2in9dDisplay(state_file, full_refresh_every=2)  # One update per run, as from cron
+            self.assertTrue(d2.can_update_partially())
+            ImageDraw.Draw(ry).rectangle((10, 20, 12, 30), fill=0)
+            d2.update(b, ry)
+            d2.set_last_frame(b, ry)
+            self.assertEqual(1, sim.commands.count(0x90))
+
+            d3 = Epd2in9dDisplay(state_file, full_refresh_every=2)
+            self.assertEqual(1, d3.partial_updates)
+            self.assertEqual(d2.last_frame.tobytes(), d3.last_frame.tobytes())
+            d3.clear()
+            self.assertFalse(Epd2in9dDisplay(state_file).can_update_partially())  # Cleared, nothing to diff against
+
+    def test_partial_display_sends_bytes(self):
+        sim = epdconfig.Simulated('epd2in9d')
+        epd2in9d.epdconfig = sim
+        epd = epd2in9d.EPD()
+        buf = bytes(range(256)) * (epd.width // 8 * epd.height // 256 + 1)
+        buf = buf[:epd.width // 8 * epd.height]
+
+        epd.display(buf)
+        epd.DisplayPartialWindow(buf, 0, 0, epd.width - 1, 255)  # Every byte value in the window
+
+        self.assertTrue(all(0 <= byte <= 0xFF for byte in sim.data))
+        self.assertEqual(bytes(byte ^ 0xFF for byte in buf[:16 * 256]), sim.get_plane(0x13)[:16 * 256])
+
+    def test_display_clear_schedule(self):
+        with tempfile.TemporaryDirectory() as path:
+            state_file = os.path.join(path, 'display-state.json')
+            sim = epdconfig.Simulated('epd2in9bc')
+            epd2in9bc.epdconfig = sim
+            d = Epd2in9bcDisplay(state_file)
+            d.clear_every_updates = 2
+            b, ry = (Image.new('1', d.size, 255), Image.new('1', d.size, 255))
+
+            self.assertTrue(d.needs_clear())  # Never cleared
+            d.clear()
+            d.update(b, ry)
+            d.set_last_frame(b, ry)
+            self.assertFalse(d.needs_clear())
+            d.update(b, ry)  # Drawn over the previous frame, a single refresh
+            d.set_last_frame(b, ry)
+            self.assertEqual(3, sim.commands.count(0x12))
+
+            clock = FixedClock(datetime(2020, 2, 1, 12, 0, tzinfo=timezone.utc))
+            d = Epd2in9bcDisplay(state_file, clock)  # Schedule kept across runs
+            d.clear_every_updates = 2
+            self.assertTrue(d.needs_clear())
+            d.clear()
+            self.assertFalse(d.needs_clear())
+            clock.advance(timedelta(seconds=config.CLEAR_EVERY_SECONDS - 1))
+            self.assertFalse(d.needs_clear())
+            clock.advance(timedelta(seconds=1))
+            self.assertTrue(d.needs_clear())  # A day later, with no updates since
+
+    def test_game_records_compare_by_value(self):
+        g1 = get_game_from_file('tests.games.live.json').with_details(
+            get_detailed_game_from_file('tests.game.period1.pp.json'))
+        g2 = get_game_from_file('tests.games.live.json').with_details(
+            get_detailed_game_from_file('tests.game.period1.pp.json'))
+
+        self.assertEqual(g1, g2)
+        self.assertEqual(1, len({g1, g2}))
+        self.assertNotEqual(g1, g1.with_details(replace(g1.details, period_remaining='03:59')))
+        self.assertFalse(hasattr(g1, '__dict__'))
+        with self.assertRaises(AttributeError):
+            g1.home.score = 5
+
+    def test_display_game_unchanged(self):
+        d = FakeEpd2in9bcDisplay(state_file=None)
+        g = get_game_from_file('tests.games.scheduled.json')
+        today = datetime(2020, 1, 1).date()
+        game_hash = get_game_hash(g, today)
+
+        self.assertFalse(d.is_game_unchanged(game_hash))
+        d.set_last_frame(View.create_image(d.size), View.create_image(d.size))
+        d.set_last_game(game_hash)
+        self.assertTrue(d.is_game_unchanged(get_game_hash(get_game_from_file('tests.games.scheduled.json'), today)))
+        # A day later 'Tomorrow' reads 'Today'
+        self.assertFalse(d.is_game_unchanged(get_game_hash(g, today + timedelta(days=1))))
+
+        g = replace(g, home=replace(g.home, score=g.home.score + 1))
+        self.assertFalse(d.is_game_unchanged(get_game_hash(g, today)))
+        d.forget_last_frame()
+        self.assertFalse(d.is_game_unchanged(game_hash))
+
+    def test_game_hash_code_and_config(self):
+        g = get_game_from_file('tests.games.scheduled.json')
+        today = date(2020, 2, 1)
+        game_hash = get_game_hash(g, today, 'a' * 40)
+
+        self.assertNotEqual(game_hash, get_game_hash(g, today, 'b' * 40))  # Pulled a new layout
+        timezone_setting = config.TIMEZONE
+        try:
+            config.TIMEZONE = 'US/Eastern'
+            self.assertNotEqual(game_hash, get_game_hash(g, today, 'a' * 40))
+        finally:
+            config.TIMEZONE = timezone_setting
+
+        with tempfile.TemporaryDirectory() as path:
+            self.assertIsNone(get_code_version(path))
+            os.makedirs(os.path.join(path, '.git', 'refs', 'heads'))
+            write_file(os.path.join(path, '.git', 'HEAD'), 'ref: refs/heads/master\n')
+            write_file(os.path.join(path, '.git', 'packed-refs'), f'{"b" * 40} refs/heads/master\n')
+            get_code_version.cache_clear()
+            self.assertEqual('b' * 40, get_code_version(path))
+            write_file(os.path.join(path, '.git', 'refs', 'heads', 'master'), f'{"c" * 40}\n')
+            get_code_version.cache_clear()
+            self.assertEqual('c' * 40, get_code_version(path))
+
+    def test_startup_imports(self):
+        times = get_import_times('main')
+        for module in STARTUP_LAZY_MODULES:
+            self.assertNotIn(module, times)  # Timed against STARTUP_IMPORT_BUDGET_MS by benchmarks.py --check
+
+    def test_api_reuses_connection(self):
+        server = StubApiHandler.start()
+        try:
+            api = NhlApi()
+            url = f'http://127.0.0.1:{server.server_port}/api/v1/schedule'
+            for _ in range(3):
+                self.assertEqual(200, api.get(url).status_code)
+            self.assertIsNone(api.get_json(url, SCHEDULE_FIRST_GAME_PATH))  # Streamed
+
+            self.assertEqual(1, StubApiHandler.connections)
+            self.assertEqual(4, len(StubApiHandler.accept_encodings))
+            self.assertIn('gzip', StubApiHandler.accept_encodings[0])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_api_cache(self):
+        server = StubApiHandler.start()
+        url = f'http://127.0.0.1:{server.server_port}/api/v1/schedule?teamId=1'
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(tmp, {'api/v1/schedule': 60, 'api/v1/teams': 60})  # Teams seeded from the file
+            try:
+                api = NhlApi(retries=0, cache=cache)
+                expected = {'totalGames': 0, 'dates': []}
+
+                # Fresh
+                self.assertEqual(expected, api.get_json(url))
+                self.assertEqual(expected, api.get_json(url))
+                self.assertEqual([200], StubApiHandler.statuses)
+
+                # Stale, revalidated
+                cache.ttls['api/v1/schedule'] = 0
+                self.assertEqual(expected, api.get_json(url))
+                self.assertEqual([200, 304], StubApiHandler.statuses)
+            finally:
+                server.shutdown()
+                server.server_close()
+
+            # Stale, API unreachable
+            self.assertEqual(expected, NhlApi(retries=0, cache=cache).get_json(url))
+
+    def test_json_stream_extract(self):
+        for filename, path, get_expected in [
+                ('tests.games.live.json', SCHEDULE_FIRST_GAME_PATH, lambda j: j['dates'][0]['games'][0]),
+                ('tests.schedule.emptyfirstdate.json', SCHEDULE_FIRST_GAME_PATH, lambda j: j['dates'][1]['games'][0]),
+                ('tests.game.finalso.json', FEED_LINESCORE_PATH, lambda j: j['liveData']['linescore'])]:
+            f = open(filename, 'rb')
+            data = f.read()
+            f.close()
+            expected = get_expected(json.loads(data))
+
+            for size in [7, 1000, 16 * 1024]:
+                chunks = (data[i:i + size] for i in range(0, len(data), size))
+                self.assertEqual(expected, extract_json(chunks, path))
+
+        self.assertIsNone(extract_json([b'{"totalGames": 0, "dates": []}'], SCHEDULE_FIRST_GAME_PATH))
+        self.assertEqual({'b': 'x\\"}'}, extract_json([r'{"a": [1, {"b": "x\\\"}"}]}'], ('a', 1)))  # Escaped quote
+
+    def test_json_stream_peak_memory(self):
+        streamed, loaded = get_parse_peaks('tests.game.finalso.json', FEED_LINESCORE_PATH)
+        self.assertLess(streamed * 4, loaded)
+
+    def test_render_benchmark(self):
+        cases = [c for c in get_render_cases() if c[0] in ['NoGame', 'LiveGame tests.game.4on4.json']]
+        results = benchmark_renders(cases, repeat=1)
+
+        self.assertEqual(['NoGame', 'LiveGame tests.game.4on4.json'], list(results.keys()))
+        for result in results.values():
+            for key in ['parse', 'build', 'draw', 'pack', 'peak']:
+                self.assertLessEqual(0, result[key])
+
+        self.assertEqual([], get_render_regressions(results, results))
+        slower = {name: dict(result, draw=result['draw'] * 3 + 2) for name, result in results.items()}
+        self.assertEqual(2, len(get_render_regressions(slower, results)))
+
+    def test_api_cache_ttls(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(tmp, {'api/v1/game': 10, 'api/v1/game/1/linescore': 5, 'api/v1/teams': 100})
+            self.assertEqual(5, cache.get_ttl(NhlApi.build_url('api/v1/game/1/linescore')))
+            self.assertEqual(10, cache.get_ttl(NhlApi.build_url('/api/v1/game/1/feed/live')))
+            self.assertEqual(100, cache.get_ttl(NhlApi.build_url('api/v1/teams')))
+            self.assertEqual(0, cache.get_ttl(NhlApi.build_url('api/v1/schedule', 'teamId=1')))
+
+    def test_api_cache_clock(self):
+        clock = FixedClock(datetime(2020, 2, 1, 12, tzinfo=timezone.utc))
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(tmp, {'api/v1/game': 10}, clock)
+            entry = cache.put(NhlApi.build_url('api/v1/game/1/feed/live'), '{}')
+            self.assertTrue(cache.is_fresh(entry))
+
+            clock.advance(timedelta(seconds=11))
+            self.assertEqual(11, cache.get_age(entry))
+            self.assertFalse(cache.is_fresh(entry))
+            self.assertTrue(cache.is_fresh(cache.touch(entry)))
+
+    def test_logo_scaled_once(self):
+        logos = os.path.join('..', 'res', 'logos')
+        view = ImagePathView(os.path.join(logos, 'vgk-b.gif'), os.path.join(logos, 'vgk-ry.gif'))
+        ImagePathView.get_scaled_image.cache_clear()
+        for _ in range(3):
+            b, ry = (View.create_image((60, 50)), View.create_image((60, 50)))
+            view.draw(b, ry)
+
+        info = ImagePathView.get_scaled_image.cache_info()
+        self.assertEqual(2, info.misses)  # Black and red planes
+        self.assertEqual(4, info.hits)
+        self.assertEqual((50, 50), ImagePathView.get_scaled_image(view.im_path, (60, 50)).size)
+
+    def test_logo_missing(self):
+        view = ImagePathView('missing-b.gif', 'missing-ry.gif')
+        self.assertRaises(FileNotFoundError, view.draw, View.create_image((60, 50)))
+
+    def test_text_fit_font_size(self):
+        path = FontProvider(os.path.join('..', 'res')).get_font_path_filename()
+        canvas = View.create_canvas(View.create_image((1, 1)))
+        for text in ['3', '2nd\n12:47', '(28-16-5)', 'Unexpected game (status=5)']:
+            for box in [(20, 10), (40, 30), (90, 60), (300, 120)]:
+                for max_size in [15, 20, 40]:
+                    # Linear shrinking, as done before the binary search
+                    size = max_size
+                    text_size = canvas.textsize(text, TextView.load_font(path, size))
+                    while text_size[0] > 8 and text_size[1] > 8 \
+                            and (text_size[0] > box[0] or text_size[1] > box[1]):
+                        size -= 2
+                        text_size = canvas.textsize(text, TextView.load_font(path, size))
+
+                    self.assertEqual(size, TextView.fit_font_size(path, text, box, max_size), (text, box, max_size))
+
+    def test_views_draw_within_box(self):
+        fp = FontProvider(os.path.join('..', 'res'))
+        logos = os.path.join('..', 'res', 'logos')
+        views = [
+            TextView('2nd\n12:47', fp),
+            TextView('PP', fp, invert_colors=True),
+            TextView('Text too long to fit', fp, max_size=15),
+            TextView('j\ng', fp),  # Fits by its text size, its descender reaches past it
+            ImagePathView(os.path.join(logos, 'vgk-b.gif'), os.path.join(logos, 'vgk-ry.gif'), p=View.end_end),
+            MissingDataView(),
+            SpacingLayout(0.1, LinearLayout([TextView('3', fp), TextView('@', fp)], [2, 1], is_vertical=True)),
+        ]
+        box = (30, 10, 90, 50)
+        for v in views:
+            expected_b, expected_ry = (View.create_image((120, 60)), View.create_image((120, 60)))
+            v.draw_isolated(expected_b, expected_ry, box)
+            b, ry = (View.create_image((120, 60)), View.create_image((120, 60)))
+            v.draw(b, ry, box)
+
+            self.assertEqual(expected_b.tobytes(), b.tobytes(), v)
+            self.assertEqual(expected_ry.tobytes(), ry.tobytes(), v)
+
+    def test_layout_geometry_shared_by_shape(self):
+        fp = FontProvider(os.path.join('..', 'res'))
+        box = (0, 0, 296, 128)
+        first = LinearLayout([TextView('1', fp), SpacingLayout(0.1, TextView('1st\n04:11', fp))], [1, 2])
+        second = LinearLayout([TextView('2', fp), SpacingLayout(0.1, TextView('1st\n03:59', fp))], [1, 2])
+        other = LinearLayout([TextView('2', fp), SpacingLayout(0.1, TextView('1st\n03:59', fp))], [1, 1])
+
+        geometry = View.get_geometry(first, box)
+        self.assertIs(geometry, View.get_geometry(second, box))
+        self.assertIsNot(geometry, View.get_geometry(other, box))
+        self.assertIsNot(geometry, View.get_geometry(first, (0, 0, 200, 100)))
+        self.assertEqual((0, 0, 98, 128), geometry.children[0].box)
+        self.assertEqual((117, 12, 276, 116), geometry.children[1].children[0].box)
+
+    def test_incremental_render(self):
+        d = FakeEpd2in9bcDisplay(state_file=None)
+        fp = FontProvider(os.path.join('..', 'res'))
+        lp = LogoProvider(NhlApi().abbrs, os.path.join('..', 'res'))
+        g = get_game_from_file('tests.games.live.json')
+        g = g.with_details(get_detailed_game_from_file('tests.game.period1.pp.json'))
+
+        renderer = Renderer()
+        LiveGame(d, g, fp, lp, renderer)
+        g = g.with_details(replace(g.details, period_remaining='03:59',
+                                   pp_remaining_seconds=g.details.pp_remaining_seconds - 12))
+        incremental = LiveGame(d, g, fp, lp, renderer)
+        self.assertEqual(2, renderer.redrawn)  # Period clock and PP clock
+
+        full = LiveGame(d, g, fp, lp)
+        self.assertLess(2, full.renderer.redrawn)
+        self.assertEqual(full.b.tobytes(), incremental.b.tobytes())
+        self.assertEqual(full.ry.tobytes(), incremental.ry.tobytes())
+
+    def test_incremental_render_every_case(self):
+        # Every screen drawn over the frame of another fixture looks the same as when drawn from scratch
+        d = FakeEpd2in9bcDisplay(state_file=None)
+        fp = FontProvider(os.path.join('..', 'res'))
+        lp = LogoProvider(NhlApi().abbrs, os.path.join('..', 'res'))
+        clock = FixedClock(datetime(2020, 2, 1, 12, 0, tzinfo=timezone.utc))
+        cases = get_render_cases()
+
+        for name, builder, games_file, feed_file in cases:
+            full = get_case_ui(builder, games_file, feed_file, d, fp, lp, clock, Renderer())
+            for other, other_builder, other_games_file, other_feed_file in cases:
+                if other_builder is not builder or other == name:
+                    continue
+                renderer = Renderer()
+                get_case_ui(builder, other_games_file, other_feed_file, d, fp, lp, clock, renderer)
+                incremental = get_case_ui(builder, games_file, feed_file, d, fp, lp, clock, renderer)
+                self.assertEqual(full.b.tobytes(), incremental.b.tobytes(), f'{name} after {other}')
+                self.assertEqual(full.ry.tobytes(), incremental.ry.tobytes(), f'{name} after {other}')
+
+    def test_clock_day_rollover(self):
+        d = FakeEpd2in9bcDisplay(state_file=None)
+        fp = FontProvider(os.path.join('..', 'res'))
+        lp = LogoProvider(NhlApi().abbrs, os.path.join('..', 'res'))
+        g = get_game_from_file('tests.games.scheduled.json')  # Sat, Feb/01 4:00PM PST
+        clock = FixedClock(datetime(2020, 2, 1, 7, 59, tzinfo=timezone.utc))  # 11:59PM PST the day before
+
+        ui = ScheduledGame(d, g, fp, lp, clock)
+        self.assertIn('Tomorrow', ui.get_time(g))
+        clock.advance(timedelta(minutes=2))
+        self.assertIn('Today', ui.get_time(g))
+
+    def test_api_next_game_after_empty_date(self):
+        f = open('tests.schedule.emptyfirstdate.json', 'rb')
+        data = f.read()
+        f.close()
+        api = NhlApi(clock=FixedClock(datetime(2020, 1, 31, 12, 0, tzinfo=timezone.utc)))
+        api.get_json = lambda url, path=None: extract_json([data[i:i + 100] for i in range(0, len(data), 100)], path)
+
+        g = api.get_next_game(1)
+        self.assertEqual(NhlApi.get_first_game(json.loads(data)).id, g.id)
+        self.assertEqual(json.loads(data)['dates'][1]['games'][0]['gamePk'], g.id)
+
+    def test_api_next_game_uses_clock(self):
+        urls = []
+        api = NhlApi(check_limit_days=2, clock=FixedClock(datetime(2020, 2, 1, 12, 0, tzinfo=timezone.utc)))
+        api.get_json = lambda url, path=None: urls.append(url)
+
+        with self.assertRaises(NoUpcomingGameError):
+            api.get_next_game(1)
+        self.assertIn('startDate=2020-02-01&endDate=2020-02-02', urls[0])
+
+    def test_render_from_template(self):
+        d = FakeEpd2in9bcDisplay(state_file=None)
+        fp = FontProvider(os.path.join('..', 'res'))
+        lp = LogoProvider(NhlApi().abbrs, os.path.join('..', 'res'))
+        g = get_game_from_file('tests.games.live.json')
+        g = g.with_details(get_detailed_game_from_file('tests.game.critical.pp.json'))
+
+        full = LiveGame(d, g, fp, lp)
+        all_leaves = full.renderer.redrawn
+
+        with tempfile.TemporaryDirectory() as path:
+            LiveGame(d, g, fp, lp, Renderer(TemplateCache(path)))
+            self.assertEqual(2, len(os.listdir(path)))
+
+            # A later run loads the template from disk and only draws the game data over it
+            templated = LiveGame(d, g, fp, lp, Renderer(TemplateCache(path)))
+            self.assertLess(templated.renderer.redrawn, all_leaves)
+            self.assertEqual(full.b.tobytes(), templated.b.tobytes())
+            self.assertEqual(full.ry.tobytes(), templated.ry.tobytes())
+
+            templates = TemplateCache(path)
+            templates.prune(60)
+            self.assertEqual(2, len(os.listdir(path)))  # Just used
+            for f in os.listdir(path):
+                os.utime(os.path.join(path, f), (0, 0))
+            templates.prune(60)
+            self.assertEqual([], os.listdir(path))
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive
+    connections = 0
+    accept_encodings = []
+    statuses = []
+
+    @staticmethod
+    def start():
+        StubApiHandler.connections = 0
+        StubApiHandler.accept_encodings = []
+        StubApiHandler.statuses = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubApiHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def setup(self):
+        super().setup()
+        StubApiHandler.connections += 1
+
+    def do_GET(self):
+        StubApiHandler.accept_encodings.append(self.headers.get('Accept-Encoding'))
+        etag = '"v1"'
+        if self.headers.get('If-None-Match') == etag:
+            StubApiHandler.statuses.append(304)
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = b'{"totalGames": 0, "dates": []}'
+        StubApiHandler.statuses.append(200)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeGpio:
+    RISING = 31
+    FALLING = 32
+
+    def __init__(self, busy_reads, edges=True):
+        self.busy_reads = busy_reads
+        self.edges = edges
+        self.edge_waits = []
+
+    def input(self, pin):
+        self.busy_reads -= 1
+        return 0 if self.busy_reads >= 0 else 1
+
+    def wait_for_edge(self, pin, edge, timeout=None):
+        if not self.edges:
+            raise RuntimeError('Conflicting edge detection already enabled for this GPIO channel')
+        self.edge_waits.append((pin, edge, timeout))
+        return pin
+
+
+def get_simulated_epd(sim):
+    epd2in9bc.epdconfig = sim
+    return epd2in9bc.EPD()
+
+
+def get_random_image(size):
+    r = random.Random(size[0] * size[1])
+    im = Image.new('1', size, 255)
+    pixels = im.load()
+    for y in range(size[1]):
+        for x in range(size[0]):
+            pixels[x, y] = r.choice((0, 255))
+    return im
+
+
+def get_reference_buffer(image, width, height):
+    # Per-pixel packing as originally done by the Waveshare drivers
+    buf = [0xFF] * (int(width / 8) * height)
+    pixels = image.load()
+    imwidth, imheight = image.size
+    for y in range(imheight):
+        for x in range(imwidth):
+            if pixels[x, y] == 0:
+                if imwidth == width:
+                    buf[int((x + y * width) / 8)] &= ~(0x80 >> (x % 8))
+                else:
+                    newx = y
+                    newy = height - x - 1
+                    buf[int((newx + newy * width) / 8)] &= ~(0x80 >> (y % 8))
+    return bytes(buf)
+
+
+class FixedClock(Clock):
+
+    def __init__(self, now_utc: datetime):
+        self.now_utc = now_utc
+
+    def now(self, tz=None):
+        if tz is None:
+            return self.now_utc.astimezone().replace(tzinfo=None)
+        return self.now_utc.astimezone(tz)
+
+    def advance(self, delta: timedelta):
+        self.now_utc += delta
+
 
 def get_game_from_file(filename):
     f = open(filename, 'r')
     j = json.loads(f.read())
     f.close()
-    return Game(j['dates'][0]['games'][0])
+    return Game.from_json(j['dates'][0]['games'][0])
 
 
 def get_detailed_game_from_file(filename):
     f = open(filename, 'r')
     j = json.loads(f.read())
     f.close()
-    return GameDetails(j)
+    return GameDetails.from_json(j)
+
+
+def get_case_ui(builder, games_file, feed_file, d, fp, lp, clock, renderer):
+    if games_file is None:
+        return builder(d, fp, renderer)
+    g = get_game_from_file(games_file)
+    if feed_file is not None:
+        g = g.with_details(get_detailed_game_from_file(feed_file))
+    if builder in [LiveGame, FinalGame]:
+        return builder(d, g, fp, lp, renderer)
+    return builder(d, g, fp, lp, clock, renderer)
 
 
 if __name__ == '__main__':
@@ -2,64 +2,70 @@ from display import *
 from layout import *
 from utils import *
 from game import *
-import pytz
+from dataclasses import replace
 import config
 import utils
 
 
-def get_ui_builder(d: BaseDisplay, fp: FontProvider, lp: LogoProvider, g: Game):
+def get_ui_builder(d: BaseDisplay, fp: FontProvider, lp: LogoProvider, g: Game, clock: Clock = None,
+                   renderer: Renderer = None):
 
     if g is None:
-        return NoGame(d, fp)
+        return NoGame(d, fp, renderer)
 
     elif GameStatus.FINAL == g.status or GameStatus.FINAL_ALT == g.status:
-        return FinalGame(d, g, fp, lp)
+        return FinalGame(d, g, fp, lp, renderer)
 
     elif GameStatus.LIVE == g.status or GameStatus.LIVE_CRITICAL == g.status:
-        return LiveGame(d, g, fp, lp)
+        return LiveGame(d, g, fp, lp, renderer)
 
     elif GameStatus.SCHEDULED == g.status:
-        return ScheduledGame(d, g, fp, lp)
+        return ScheduledGame(d, g, fp, lp, clock, renderer)
 
     elif GameStatus.SCHEDULED_TIMETBD == g.status:
-        return ScheduledTimeTbdGame(d, g, fp, lp)
+        return ScheduledTimeTbdGame(d, g, fp, lp, clock, renderer)
 
     elif GameStatus.POSTPONED == g.status:
-        return PostponedGame(d, g, fp, lp)
+        return PostponedGame(d, g, fp, lp, clock, renderer)
 
     else:
-        return UnexpectedGame(d, g, fp, lp)
+        return UnexpectedGame(d, g, fp, lp, clock, renderer)
 
 
 class GameUiBuilder:
 
-    def __init__(self, d: BaseDisplay, g: Game):
+    def __init__(self, d: BaseDisplay, g: Game, clock: Clock = None, renderer: Renderer = None):
         self.d = d
         self.g = g
+        self.clock = clock if clock is not None else Clock()
+        self.renderer = renderer if renderer is not None else Renderer()  # Pass the same one to consecutive frames
         self.b = View.create_image(d.size)
         self.ry = View.create_image(d.size)
 
+    def render(self, view: View):
+        self.renderer.draw(view, self.b, self.ry)
+
     def deploy(self):
         self.d.update(self.b, self.ry)
+        self.d.set_last_frame(self.b, self.ry)
 
 
 class NoGame(GameUiBuilder):
 
-    def __init__(self, d: BaseDisplay, fp: FontProvider):
+    def __init__(self, d: BaseDisplay, fp: FontProvider, renderer: Renderer = None):
         # noinspection PyTypeChecker
-        super().__init__(d, g=None)
+        super().__init__(d, g=None, renderer=renderer)
 
         message = 'No upcoming games'
 
-        SpacingLayout(0.05,
-                      TextView(message, fp)) \
-            .draw(self.b, self.ry)
+        self.render(SpacingLayout(0.05,
+                                  TextView(message, fp)))
 
 
 class LiveGame(GameUiBuilder):
 
-    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider):
-        super().__init__(d, g)
+    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider, renderer: Renderer = None):
+        super().__init__(d, g, renderer=renderer)
         self.fp = fp
         self.lp = lp
 
@@ -118,13 +124,14 @@ class LiveGame(GameUiBuilder):
         ], side_column_weights, is_vertical=True)
 
         all_columns = LinearLayout([away_column, center_column, home_column], [2, 5, 2])
-        SpacingLayout(0.02, all_columns).draw(self.b, self.ry)
+        self.render(SpacingLayout(0.02, all_columns))
 
 
 class ScheduledGame(GameUiBuilder):
 
-    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider):
-        super().__init__(d, g)
+    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider, clock: Clock = None,
+                 renderer: Renderer = None):
+        super().__init__(d, g, clock, renderer)
         self.fp = fp
         self.lp = lp
 
@@ -143,43 +150,44 @@ class ScheduledGame(GameUiBuilder):
             TeamRecord(self.g.home, self.fp, p=View.center_end)
         ], icon_record_weights, is_vertical=True)
 
-        LinearLayout([away_column, date_time_column, home_column], [3, 4, 3]) \
-            .draw(self.b, self.ry)
+        self.render(LinearLayout([away_column, date_time_column, home_column], [3, 4, 3]))
 
     def get_time(self, g):
-        day, time, tz = get_friendly_game_time(g, to_tz=pytz.timezone(config.TIMEZONE))
+        day, time, tz = get_friendly_game_time(g, self.clock.now(timezone.utc), get_timezone(config.TIMEZONE))
         return f'\n@\n\n{day}\n{time}\n({tz})'
 
 
 class ScheduledTimeTbdGame(ScheduledGame):
 
-    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider):
-        super().__init__(d, g, fp, lp)
+    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider, clock: Clock = None,
+                 renderer: Renderer = None):
+        super().__init__(d, g, fp, lp, clock, renderer)
 
     def get_time(self, g):
         # Time is TBD, force-add 3 hours to show correct day of game in most continental US timezones
-        g.datetime_utc += timedelta(hours=3)
-        day, time, tz = get_friendly_game_time(g, to_tz=pytz.timezone(config.TIMEZONE))
+        g = replace(g, datetime_utc=g.datetime_utc + timedelta(hours=3))
+        day, time, tz = get_friendly_game_time(g, self.clock.now(timezone.utc), get_timezone(config.TIMEZONE))
         return f'\n@\n\n{day}\nTime TBD'
 
 
 class PostponedGame(ScheduledGame):
 
-    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider):
-        super().__init__(d, g, fp, lp)
+    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider, clock: Clock = None,
+                 renderer: Renderer = None):
+        super().__init__(d, g, fp, lp, clock, renderer)
 
     def get_time(self, g):
         # Postponed but just like in ScheduledTimeTbdGame...
         # Force-add 3 hours to show correct day of game in most continental US timezones
-        g.datetime_utc += timedelta(hours=3)
-        day, time, tz = get_friendly_game_time(g, to_tz=pytz.timezone(config.TIMEZONE))
+        g = replace(g, datetime_utc=g.datetime_utc + timedelta(hours=3))
+        day, time, tz = get_friendly_game_time(g, self.clock.now(timezone.utc), get_timezone(config.TIMEZONE))
         return f'\n@\n\n{day}\nPostponed'
 
 
 class FinalGame(GameUiBuilder):
 
-    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider):
-        super().__init__(d, g)
+    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider, renderer: Renderer = None):
+        super().__init__(d, g, renderer=renderer)
         self.fp = fp
         self.lp = lp
 
@@ -208,29 +216,28 @@ class FinalGame(GameUiBuilder):
             TeamRecord(self.g.home, self.fp, p=View.center_end)
         ], [3, 1], is_vertical=True)
 
-        SpacingLayout(0.05, LinearLayout([away_column, score_column, home_column], [3, 4, 3])) \
-            .draw(self.b, self.ry)
+        self.render(SpacingLayout(0.05, LinearLayout([away_column, score_column, home_column], [3, 4, 3])))
 
 
 class UnexpectedGame(GameUiBuilder):
-    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider):
-        super().__init__(d, g)
+    def __init__(self, d: BaseDisplay, g: Game, fp: FontProvider, lp: LogoProvider, clock: Clock = None,
+                 renderer: Renderer = None):
+        super().__init__(d, g, clock, renderer)
 
-        day, time, tz = get_friendly_game_time(g, to_tz=pytz.timezone(config.TIMEZONE))
+        day, time, tz = get_friendly_game_time(g, self.clock.now(timezone.utc), get_timezone(config.TIMEZONE))
         date_time = TextView(f'\n@\n\n{day}\n{time}\n({tz})', fp)
 
         message = f'Unexpected game (status={self.g.original_status})'
 
-        SpacingLayout(0.05,
-                      LinearLayout([
-                          LinearLayout([
-                              TeamLogo(self.g.away, lp),
-                              date_time,
-                              TeamLogo(self.g.home, lp),
-                          ]),
-                          TextView(message, fp, max_size=15, p=View.center_end)
-                      ], [6, 1], is_vertical=True))\
-            .draw(self.b, self.ry)
+        self.render(SpacingLayout(0.05,
+                                  LinearLayout([
+                                      LinearLayout([
+                                          TeamLogo(self.g.away, lp),
+                                          date_time,
+                                          TeamLogo(self.g.home, lp),
+                                      ]),
+                                      TextView(message, fp, max_size=15, p=View.center_end)
+                                  ], [6, 1], is_vertical=True)))
 
 
 # Custom Views
@@ -238,11 +245,19 @@ class UnexpectedGame(GameUiBuilder):
 
 class Empty(View):
 
-    def draw(self, im: Image, im_ry: Image = None):
+    is_static = True
+
+    def get_key(self):
+        return self.__class__.__name__
+
+    def draw(self, im: Image, im_ry: Image = None, box=None):
         pass
 
 
 class TeamRecord(View):
+
+    is_static = True
+
     def __init__(self, t: Team, fp: FontProvider, p=View.center_center):
 
         record = f'{t.wins}-{t.losses}'
@@ -254,20 +269,35 @@ class TeamRecord(View):
         self.fp = fp
         self.p = p
 
-    def draw(self, im_b: Image, im_ry: Image = None):
-        TextView(self.r, self.fp, max_size=16, p=self.p).draw(im_b, im_ry)
+    def get_key(self):
+        return self.__class__.__name__, self.r, self.p
+
+    def get_files(self):
+        return [self.fp.get_font_path_filename()]
+
+    def draw(self, im_b: Image, im_ry: Image = None, box=None):
+        TextView(self.r, self.fp, max_size=16, p=self.p).draw(im_b, im_ry, box)
 
 
 class TeamLogo(View):
+
+    is_static = True
+
     def __init__(self, t: Team, lp: LogoProvider, p=View.center_center):
         self.b_path, self.ry_path = lp.get_team_logo_path(t.id)
         self.p = p
 
-    def draw(self, im: Image, im_ry: Image = None):
+    def get_key(self):
+        return self.__class__.__name__, self.b_path, self.ry_path, self.p
+
+    def get_files(self):
+        return [self.b_path, self.ry_path]
+
+    def draw(self, im: Image, im_ry: Image = None, box=None):
 
         try:
-            ImagePathView(self.b_path, self.ry_path, p=self.p).draw(im, im_ry)
+            ImagePathView(self.b_path, self.ry_path, p=self.p).draw(im, im_ry, box)
         except FileNotFoundError:
             SpacingLayout(0.15,
                           MissingDataView()) \
-                .draw(im, im_ry)
+                .draw(im, im_ry, box)
@@ -1,7 +1,18 @@
 import re
+import os
+import json
+import hashlib
 from os import path
-from datetime import datetime, timezone, tzinfo, timedelta
-from game import Game
+from dataclasses import asdict
+from functools import lru_cache
+from datetime import datetime, date, timezone, tzinfo, timedelta
+from game import Game, GameStatus
+import config
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    from backports.zoneinfo import ZoneInfo
 
 
 def write_file(filename, content):
@@ -9,13 +20,36 @@ def write_file(filename, content):
         file.write(content)
 
 
+def write_file_atomic(filename, content):
+    # Readers never see a partially written file, even if the process dies mid-write
+    tmp_filename = f'{filename}.tmp'
+    write_file(tmp_filename, content)
+    os.replace(tmp_filename, filename)
+
+
 def read_file(filename):
     with open(filename, 'r') as file:
         return file.read()
 
 
-def get_friendly_game_time(g: Game, now_utc: datetime = datetime.now(timezone.utc),
-                           to_tz: tzinfo = timezone.utc):
+class Clock:
+    """
+    Source of the current time, passed around instead of calling datetime.now() so tests can move it.
+    """
+
+    def now(self, tz: tzinfo = None) -> datetime:
+        return datetime.now(tz)
+
+
+@lru_cache(maxsize=4)
+def get_timezone(name: str) -> tzinfo:
+    return ZoneInfo(name)
+
+
+def get_friendly_game_time(g: Game, now_utc: datetime = None, to_tz: tzinfo = timezone.utc):
+
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
 
     # Convert from UTC to provided tz
     game_local = g.datetime_utc.astimezone(to_tz)
@@ -39,6 +73,60 @@ def get_friendly_game_time(g: Game, now_utc: datetime = datetime.now(timezone.ut
     return friendly_day, friendly_time, friendly_tz
 
 
+def get_next_morning(now_utc: datetime, to_tz: tzinfo = timezone.utc, hour: int = config.DAEMON_MORNING_HOUR):
+    now_local = now_utc.astimezone(to_tz)
+    morning = datetime(now_local.year, now_local.month, now_local.day, hour)
+    if morning <= now_local.replace(tzinfo=None):
+        morning += timedelta(days=1)
+    return morning.replace(tzinfo=to_tz)
+
+
+def get_seconds_until_next_update(g: Game, now_utc: datetime, to_tz: tzinfo = timezone.utc,
+                                  live_seconds: int = config.CHECK_UPDATE_LIVE_GAME_SECONDS):
+
+    if g is not None and (GameStatus.LIVE == g.status or GameStatus.LIVE_CRITICAL == g.status):
+        return live_seconds
+
+    next_update = get_next_morning(now_utc, to_tz)
+
+    if g is not None and GameStatus.SCHEDULED == g.status:
+        if g.datetime_utc <= now_utc:
+            return live_seconds  # Past the scheduled time, waiting for puck drop
+        next_update = min(next_update, g.datetime_utc)
+
+    return max(int((next_update - now_utc).total_seconds()), 1)
+
+
+@lru_cache(maxsize=4)
+def get_code_version(repo_path: str):
+    # Commit checked out in repo_path (e.g. after a git pull), read from .git without running git; None if unknown
+    git_path = os.path.join(repo_path, '.git')
+    try:
+        head = read_file(os.path.join(git_path, 'HEAD')).strip()
+        if not head.startswith('ref: '):
+            return head  # Detached
+        ref = head[len('ref: '):]
+        if os.path.exists(os.path.join(git_path, ref)):
+            return read_file(os.path.join(git_path, ref)).strip()
+        for line in read_file(os.path.join(git_path, 'packed-refs')).splitlines():
+            if line.endswith(f' {ref}'):
+                return line.split(' ')[0]
+    except OSError:
+        pass
+    return None
+
+
+def get_game_hash(g: Game, today: date, code_version: str = None):
+    """
+    Everything a frame is drawn from: the game, the date for 'Today'/'Tomorrow', the settings and the code
+    (layouts, fonts and logos). Unlike hash(g), stable across runs.
+    """
+    settings = {k: getattr(config, k) for k in dir(config) if k.isupper()}
+    state = {'game': asdict(g) if g is not None else None, 'today': today.isoformat(), 'config': settings,
+             'code': code_version}
+    return hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+
 def pp_seconds_to_friendly(seconds: int):
     d = timedelta(seconds=seconds)
     formatted = str(d)